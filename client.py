@@ -1,47 +1,4 @@
-import requests
-from typing import List, Dict
-
-
-class InvariantClient:
-    def __init__(self, server_url: str):
-        self.server = server_url
-        self.Policy = self._Policy(self)
-        self.Monitor = self._Monitor(self)
-
-    class _Policy:
-        def __init__(self, invariant):
-            self.server = invariant.server
-
-        def from_string(self, policy: str):
-            self.policy = policy
-            return self
-
-        def analyze(self, trace: List[Dict]):
-            response = requests.post(
-                f"{self.server}/api/policy/analyze",
-                json={"trace": trace, "policy": self.policy},
-            )
-            return response.json()
-
-    class _Monitor:
-        def __init__(self, invariant):
-            self.server = invariant.server
-
-        def from_string(self, policy: str):
-            self.policy = policy
-            return self
-
-        def check(self, past_events: List[Dict], pending_events: List[Dict]):
-            response = requests.post(
-                f"{self.server}/api/monitor/check",
-                json={
-                    "past_events": past_events,
-                    "pending_events": pending_events,
-                    "policy": self.policy,
-                },
-            )
-            return response.json()
-
+from invariant_client import InvariantClient
 
 # Example usage
 invariant = InvariantClient("http://127.0.0.1:8000")
@@ -171,9 +128,10 @@ events = [
     },
 ]
 
-past_events = []
+# A monitor session keeps the history on the server, so only new events are sent
+with monitor.session() as session:
+    for i, event in enumerate(events):
+        result = session.check([event])
+        print(i, "Monitor Check Result:", result)
 
-for i, event in enumerate(events):
-    result = monitor.check(past_events, [event])
-    past_events.append(event)
-    print(i, "Monitor Check Result:", result)
+invariant.close()
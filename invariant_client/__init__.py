@@ -0,0 +1,15 @@
+from invariant_client.client import (
+    AsyncInvariantClient,
+    AsyncMonitorSession,
+    InvariantClient,
+    InvariantError,
+    MonitorSession,
+)
+
+__all__ = [
+    "AsyncInvariantClient",
+    "AsyncMonitorSession",
+    "InvariantClient",
+    "InvariantError",
+    "MonitorSession",
+]
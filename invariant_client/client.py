@@ -0,0 +1,483 @@
+import asyncio
+import gzip
+import itertools
+import json
+import random
+import time
+from typing import Dict, List, Optional
+
+import httpx
+import websockets
+from websockets.sync.client import connect as ws_connect
+
+RETRY_STATUS_CODES = {429, 503}
+
+
+class InvariantError(Exception):
+    def __init__(self, detail, status_code: Optional[int] = None):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+class _Base:
+    def __init__(
+        self,
+        server_url: str,
+        timeout: float = 30.0,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        max_connections: int = 100,
+        batch_size: int = 32,
+        compress_threshold: Optional[int] = 1024,
+    ):
+        self.server = server_url.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.batch_size = batch_size
+        self.compress_threshold = compress_threshold
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        )
+
+    def _session_url(self) -> str:
+        if self.server.startswith("https://"):
+            return "wss://" + self.server[len("https://") :] + "/api/monitor/session"
+        return "ws://" + self.server.removeprefix("http://") + "/api/monitor/session"
+
+    def _encode(self, data: Dict, headers: Optional[Dict]):
+        content = json.dumps(data).encode()
+        headers = {"content-type": "application/json", **(headers or {})}
+        # bodies are encoded once and reused across retries
+        if (
+            self.compress_threshold is not None
+            and len(content) >= self.compress_threshold
+        ):
+            content = gzip.compress(content, compresslevel=5)
+            headers["content-encoding"] = "gzip"
+        return content, headers
+
+    def _should_retry(self, attempt: int, response: Optional[httpx.Response]) -> bool:
+        if attempt >= self.max_retries:
+            return False
+        return response is None or response.status_code in RETRY_STATUS_CODES
+
+    def _retry_delay(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        if response is not None:
+            try:
+                return float(response.headers["retry-after"])
+            except (KeyError, ValueError):
+                pass
+        # exponential backoff with full jitter
+        return random.uniform(0, self.backoff * 2**attempt)
+
+    def _result(self, response: httpx.Response):
+        try:
+            body = response.json()
+        except ValueError:
+            body = response.text
+        if response.is_error:
+            detail = body.get("detail", body) if isinstance(body, dict) else body
+            raise InvariantError(detail, response.status_code)
+        # the server passes sandbox errors through as a JSON string
+        if not isinstance(body, (dict, list)):
+            raise InvariantError(body, response.status_code)
+        return body
+
+    def _batches(self, traces: List[List[Dict]]) -> List[List[List[Dict]]]:
+        return [
+            traces[i : i + self.batch_size]
+            for i in range(0, len(traces), self.batch_size)
+        ]
+
+
+class InvariantClient(_Base):
+    """Synchronous client for the Invariant server.
+
+    Connections are pooled and kept alive for the lifetime of the client, so
+    it should be created once and closed (or used as a context manager).
+    """
+
+    def __init__(self, server_url: str, **kwargs):
+        super().__init__(server_url, **kwargs)
+        self._client = httpx.Client(
+            base_url=self.server, timeout=self.timeout, limits=self.limits
+        )
+        self.Policy = _PolicyFactory(self)
+        self.Monitor = _MonitorFactory(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._client.close()
+
+    def _post(self, path: str, data: Dict, headers: Optional[Dict] = None):
+        content, headers = self._encode(data, headers)
+        for attempt in itertools.count():
+            try:
+                response = self._client.post(path, content=content, headers=headers)
+            except httpx.TransportError:
+                if not self._should_retry(attempt, None):
+                    raise
+                response = None
+            else:
+                if not self._should_retry(attempt, response):
+                    return self._result(response)
+            time.sleep(self._retry_delay(attempt, response))
+
+    def analyze(
+        self, policy: str, trace: List[Dict], cache: bool = True, mode: str = "all"
+    ) -> Dict:
+        return self._post(
+            "/api/policy/analyze",
+            {"trace": trace, "policy": policy, "mode": mode},
+            headers=None if cache else {"cache-control": "no-cache"},
+        )
+
+    def analyze_batch(
+        self,
+        policy: str,
+        traces: List[List[Dict]],
+        cache: bool = True,
+        mode: str = "all",
+    ) -> List[Dict]:
+        results = []
+        for batch in self._batches(traces):
+            results.extend(
+                self._post(
+                    "/api/policy/analyze/batch",
+                    {"traces": batch, "policy": policy, "mode": mode},
+                    headers=None if cache else {"cache-control": "no-cache"},
+                )
+            )
+        return results
+
+    def check(
+        self,
+        policy: str,
+        past_events: List[Dict],
+        pending_events: List[Dict],
+        cache: bool = True,
+        mode: str = "all",
+    ) -> List:
+        return self._post(
+            "/api/monitor/check",
+            {
+                "past_events": past_events,
+                "pending_events": pending_events,
+                "policy": policy,
+                "mode": mode,
+            },
+            headers=None if cache else {"cache-control": "no-cache"},
+        )
+
+    def session(
+        self,
+        policy: str,
+        past_events: Optional[List[Dict]] = None,
+        mode: str = "all",
+    ) -> "MonitorSession":
+        return MonitorSession(
+            self._session_url(), policy, past_events, self.timeout, mode
+        )
+
+
+class AsyncInvariantClient(_Base):
+    """Asyncio client for the Invariant server.
+
+    ``analyze_batch`` sends its batches concurrently, and monitor sessions
+    allow several checks to be in flight at once.
+    """
+
+    def __init__(self, server_url: str, **kwargs):
+        super().__init__(server_url, **kwargs)
+        self._client = httpx.AsyncClient(
+            base_url=self.server, timeout=self.timeout, limits=self.limits
+        )
+        self.Policy = _PolicyFactory(self)
+        self.Monitor = _MonitorFactory(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        await self._client.aclose()
+
+    async def _post(self, path: str, data: Dict, headers: Optional[Dict] = None):
+        content, headers = self._encode(data, headers)
+        for attempt in itertools.count():
+            try:
+                response = await self._client.post(
+                    path, content=content, headers=headers
+                )
+            except httpx.TransportError:
+                if not self._should_retry(attempt, None):
+                    raise
+                response = None
+            else:
+                if not self._should_retry(attempt, response):
+                    return self._result(response)
+            await asyncio.sleep(self._retry_delay(attempt, response))
+
+    async def analyze(
+        self, policy: str, trace: List[Dict], cache: bool = True, mode: str = "all"
+    ) -> Dict:
+        return await self._post(
+            "/api/policy/analyze",
+            {"trace": trace, "policy": policy, "mode": mode},
+            headers=None if cache else {"cache-control": "no-cache"},
+        )
+
+    async def analyze_batch(
+        self,
+        policy: str,
+        traces: List[List[Dict]],
+        cache: bool = True,
+        mode: str = "all",
+    ) -> List[Dict]:
+        batches = await asyncio.gather(
+            *[
+                self._post(
+                    "/api/policy/analyze/batch",
+                    {"traces": batch, "policy": policy, "mode": mode},
+                    headers=None if cache else {"cache-control": "no-cache"},
+                )
+                for batch in self._batches(traces)
+            ]
+        )
+        return [result for batch in batches for result in batch]
+
+    async def check(
+        self,
+        policy: str,
+        past_events: List[Dict],
+        pending_events: List[Dict],
+        cache: bool = True,
+        mode: str = "all",
+    ) -> List:
+        return await self._post(
+            "/api/monitor/check",
+            {
+                "past_events": past_events,
+                "pending_events": pending_events,
+                "policy": policy,
+                "mode": mode,
+            },
+            headers=None if cache else {"cache-control": "no-cache"},
+        )
+
+    def session(
+        self,
+        policy: str,
+        past_events: Optional[List[Dict]] = None,
+        mode: str = "all",
+    ) -> "AsyncMonitorSession":
+        return AsyncMonitorSession(
+            self._session_url(), policy, past_events, self.timeout, mode
+        )
+
+
+class MonitorSession:
+    """Monitor session over a WebSocket; only new events are sent per check."""
+
+    def __init__(
+        self,
+        url: str,
+        policy: str,
+        past_events: Optional[List[Dict]] = None,
+        timeout: Optional[float] = None,
+        mode: str = "all",
+    ):
+        self.url = url
+        self.policy = policy
+        self.past_events = list(past_events or [])
+        self.timeout = timeout
+        self.mode = mode
+        self._ids = itertools.count()
+        self._ws = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def open(self):
+        self._ws = ws_connect(self.url, open_timeout=self.timeout)
+        self._ws.send(
+            json.dumps(
+                {
+                    "policy": self.policy,
+                    "past_events": self.past_events,
+                    "mode": self.mode,
+                }
+            )
+        )
+
+    def close(self):
+        if self._ws is not None:
+            self._ws.close()
+            self._ws = None
+
+    def check(self, pending_events: List[Dict], commit: bool = True) -> List:
+        if self._ws is None:
+            self.open()
+        id = next(self._ids)
+        self._ws.send(
+            json.dumps({"id": id, "pending_events": pending_events, "commit": commit})
+        )
+        if commit:
+            self.past_events.extend(pending_events)
+        while True:
+            message = json.loads(self._ws.recv(timeout=self.timeout))
+            if message.get("id") == id:
+                if "error" in message:
+                    raise InvariantError(message["error"])
+                return message["result"]
+
+
+class AsyncMonitorSession:
+    """Asyncio monitor session over a WebSocket.
+
+    ``check`` may be awaited concurrently to pipeline events: each event is
+    sent immediately and checked against the events sent before it.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        policy: str,
+        past_events: Optional[List[Dict]] = None,
+        timeout: Optional[float] = None,
+        mode: str = "all",
+    ):
+        self.url = url
+        self.policy = policy
+        self.past_events = list(past_events or [])
+        self.timeout = timeout
+        self.mode = mode
+        self._ids = itertools.count()
+        self._ws = None
+        self._reader = None
+        self._opening = asyncio.Lock()
+        self._waiting: Dict[int, asyncio.Future] = {}
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def open(self):
+        self._ws = await websockets.connect(self.url, open_timeout=self.timeout)
+        await self._ws.send(
+            json.dumps(
+                {
+                    "policy": self.policy,
+                    "past_events": self.past_events,
+                    "mode": self.mode,
+                }
+            )
+        )
+        self._reader = asyncio.create_task(self._read())
+
+    async def close(self):
+        if self._ws is not None:
+            await self._ws.close()
+            await asyncio.gather(self._reader, return_exceptions=True)
+            self._ws = None
+
+    async def _read(self):
+        try:
+            async for data in self._ws:
+                message = json.loads(data)
+                future = self._waiting.pop(message.get("id"), None)
+                if future is None or future.done():
+                    continue
+                if "error" in message:
+                    future.set_exception(InvariantError(message["error"]))
+                else:
+                    future.set_result(message["result"])
+        finally:
+            for future in self._waiting.values():
+                if not future.done():
+                    future.set_exception(InvariantError("session closed"))
+            self._waiting.clear()
+
+    async def check(self, pending_events: List[Dict], commit: bool = True) -> List:
+        async with self._opening:
+            if self._ws is None:
+                await self.open()
+        id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[id] = future
+        if commit:
+            self.past_events.extend(pending_events)
+        await self._ws.send(
+            json.dumps({"id": id, "pending_events": pending_events, "commit": commit})
+        )
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        finally:
+            self._waiting.pop(id, None)
+
+
+class _PolicyFactory:
+    def __init__(self, invariant):
+        self.invariant = invariant
+
+    def from_string(self, policy: str) -> "_BoundPolicy":
+        return _BoundPolicy(self.invariant, policy)
+
+
+class _BoundPolicy:
+    def __init__(self, invariant, policy: str):
+        self.invariant = invariant
+        self.policy = policy
+
+    def analyze(self, trace: List[Dict], cache: bool = True, mode: str = "all"):
+        return self.invariant.analyze(self.policy, trace, cache=cache, mode=mode)
+
+    def analyze_batch(
+        self, traces: List[List[Dict]], cache: bool = True, mode: str = "all"
+    ):
+        return self.invariant.analyze_batch(self.policy, traces, cache=cache, mode=mode)
+
+
+class _MonitorFactory:
+    def __init__(self, invariant):
+        self.invariant = invariant
+
+    def from_string(self, policy: str) -> "_BoundMonitor":
+        return _BoundMonitor(self.invariant, policy)
+
+
+class _BoundMonitor:
+    def __init__(self, invariant, policy: str):
+        self.invariant = invariant
+        self.policy = policy
+
+    def check(
+        self,
+        past_events: List[Dict],
+        pending_events: List[Dict],
+        cache: bool = True,
+        mode: str = "all",
+    ):
+        return self.invariant.check(
+            self.policy, past_events, pending_events, cache=cache, mode=mode
+        )
+
+    def session(self, past_events: Optional[List[Dict]] = None, mode: str = "all"):
+        return self.invariant.session(self.policy, past_events, mode)
@@ -0,0 +1,225 @@
+import json
+import zlib
+from prometheus_client import Histogram
+from starlette.datastructures import Headers
+from server.config import settings
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BODY_SIZE_BUCKETS = [2**i for i in range(8, 28, 2)]  # 256 B to 64 MiB
+
+REQUEST_BODY_BYTES = Histogram(
+    "invariant_server_request_body_bytes",
+    "Size of request bodies as received (compressed) and after decoding (uncompressed)",
+    ["handler", "encoding", "size"],
+    buckets=BODY_SIZE_BUCKETS,
+)
+RESPONSE_BODY_BYTES = Histogram(
+    "invariant_server_response_body_bytes",
+    "Size of response bodies before (uncompressed) and after (compressed) encoding",
+    ["handler", "encoding", "size"],
+    buckets=BODY_SIZE_BUCKETS,
+)
+
+
+class RequestTooLarge(Exception):
+    pass
+
+
+class InvalidBody(Exception):
+    pass
+
+
+def handler_label(scope) -> str:
+    # static assets are grouped together to keep the label cardinality bounded
+    path = scope["path"]
+    return path if path.startswith("/api/") or path == "/metrics" else "/"
+
+
+class _GzipDecoder:
+    def __init__(self, max_size: int):
+        # wbits=47 accepts both gzip and zlib streams
+        self.decoder = zlib.decompressobj(wbits=47)
+        self.max_size = max_size
+        self.size = 0
+
+    def decode(self, chunk: bytes, final: bool) -> bytes:
+        try:
+            data = self.decoder.decompress(chunk, self.max_size - self.size + 1)
+            if self.decoder.unconsumed_tail:
+                raise RequestTooLarge()
+            if final:
+                data += self.decoder.flush()
+                if not self.decoder.eof:
+                    raise InvalidBody("truncated gzip stream")
+        except zlib.error as e:
+            raise InvalidBody(str(e))
+        self.size += len(data)
+        return data
+
+
+class _ZstdDecoder:
+    # zstd cannot cap the output of a decompress call, but a block decodes to
+    # at most 128 KiB and needs at least one byte of input to complete. Input
+    # is fed in slices small enough that the output cannot pass the limit by
+    # more than one block.
+    MAX_BLOCK_SIZE = 128 * 1024
+
+    def __init__(self, max_size: int):
+        self.decoder = zstandard.ZstdDecompressor().decompressobj()
+        self.max_size = max_size
+        self.size = 0
+
+    def decode(self, chunk: bytes, final: bool) -> bytes:
+        data = bytearray()
+        view = memoryview(chunk)
+        offset = 0
+        try:
+            while offset < len(view):
+                remaining = self.max_size - self.size - len(data)
+                if remaining < 0:
+                    raise RequestTooLarge()
+                step = max(1, remaining // self.MAX_BLOCK_SIZE)
+                data += self.decoder.decompress(view[offset : offset + step])
+                offset += step
+        except zstandard.ZstdError as e:
+            raise InvalidBody(str(e))
+        if self.size + len(data) > self.max_size:
+            raise RequestTooLarge()
+        if final and not self.decoder.eof:
+            raise InvalidBody("truncated zstd stream")
+        self.size += len(data)
+        return bytes(data)
+
+
+class DecompressRequestMiddleware:
+    """Decodes gzip and zstd encoded request bodies while they are streamed in.
+
+    Downstream middleware (including body hashing) and handlers only ever see
+    the decoded body. Decoded bodies larger than ``max_request_size`` are
+    rejected with 413.
+    """
+
+    def __init__(self, app, max_size: int | None = None):
+        self.app = app
+        self.max_size = max_size or settings.max_request_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        encoding = headers.get("content-encoding", "identity").strip().lower()
+        if encoding == "identity":
+            decoder = None
+        elif encoding in ("gzip", "x-gzip", "deflate"):
+            decoder = _GzipDecoder(self.max_size)
+        elif encoding == "zstd" and zstandard is not None:
+            decoder = _ZstdDecoder(self.max_size)
+        else:
+            await self.error(send, 415, f"Unsupported Content-Encoding: {encoding}")
+            return
+
+        if decoder is not None:
+            scope = dict(scope)
+            scope["headers"] = [
+                (key, value)
+                for key, value in scope["headers"]
+                if key not in (b"content-encoding", b"content-length")
+            ]
+
+        handler = handler_label(scope)
+        received = decoded = 0
+        response_started = False
+
+        async def receive_decoded():
+            nonlocal received, decoded
+            message = await receive()
+            if message["type"] != "http.request":
+                return message
+
+            body = message.get("body", b"")
+            final = not message.get("more_body", False)
+            received += len(body)
+            if decoder is not None:
+                body = decoder.decode(body, final)
+            decoded += len(body)
+            if decoded > self.max_size:
+                raise RequestTooLarge()
+
+            if final:
+                REQUEST_BODY_BYTES.labels(handler, encoding, "compressed").observe(
+                    received
+                )
+                REQUEST_BODY_BYTES.labels(handler, encoding, "uncompressed").observe(
+                    decoded
+                )
+            return {**message, "body": body}
+
+        async def send_tracked(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive_decoded, send_tracked)
+        except RequestTooLarge:
+            if response_started:
+                raise
+            await self.error(send, 413, "Request body too large")
+        except InvalidBody as e:
+            if response_started:
+                raise
+            await self.error(send, 400, f"Invalid {encoding} request body: {e}")
+
+    async def error(self, send, status_code: int, detail: str):
+        body = json.dumps({"detail": detail}).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status_code,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+
+class ResponseSizeMiddleware:
+    """Records response body sizes; used on both sides of the gzip middleware."""
+
+    def __init__(self, app, size: str):
+        self.app = app
+        self.size = size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        handler = handler_label(scope)
+        encoding = "identity"
+        length = 0
+
+        async def send_tracked(message):
+            nonlocal encoding, length
+            if message["type"] == "http.response.start":
+                encoding = Headers(raw=message["headers"]).get(
+                    "content-encoding", "identity"
+                )
+            elif message["type"] == "http.response.body":
+                length += len(message.get("body", b""))
+                if not message.get("more_body", False):
+                    RESPONSE_BODY_BYTES.labels(handler, encoding, self.size).observe(
+                        length
+                    )
+            await send(message)
+
+        await self.app(scope, receive, send_tracked)
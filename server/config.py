@@ -1,9 +1,25 @@
 from pydantic_settings import BaseSettings
+from typing import Dict, List
 
 
 class Settings(BaseSettings):
     production: bool = False
     idle_timeout: int = 10 * 60  # 10 minutes of inactivity before stopping the process
+    preload_window: int = 24 * 60 * 60  # preload detectors used in the last day
+    sandbox_start_timeout: int = 5 * 60  # 5 minutes for the sandbox to become ready
+    log_retention: int = 30 * 24 * 60 * 60  # 30 days of request logs, 0 keeps all
+    log_rollup_retention: int = 365 * 24 * 60 * 60  # 1 year of per-minute rollups
+    log_prune_interval: int = 60 * 60  # prune old logs once per hour
+    workers: List[str] = []  # tcp:// or tls:// sandbox workers instead of a local one
+    worker_token: str = ""  # shared token sent to workers
+    worker_tls_ca: str | None = None  # CA bundle to verify tls:// workers
+    worker_health_interval: int = 10  # seconds between worker health checks
+    sandbox_concurrency: int = 32  # concurrent sandbox requests, 0 for no limit
+    # slots only the lane can use, the rest are shared by weight
+    lane_reserved: Dict[str, int] = {"interactive": 8, "bulk": 0}
+    lane_weights: Dict[str, int] = {"interactive": 4, "bulk": 1}
+    max_request_size: int = 64 * 1024 * 1024  # 64 MiB of decoded request body
+    relevance_filter: bool = True  # only send events a policy can match to the sandbox
 
 
 settings = Settings()
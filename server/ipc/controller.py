@@ -2,11 +2,24 @@ import subprocess
 import sys
 import json
 import os
+import re
 from server.config import settings
+from server.ipc.lanes import BULK, LaneScheduler
+from server.ipc.workers import WorkerPool
+from prometheus_client import Histogram
 import asyncio
 import psutil
 import time
 
+DETECTOR_IMPORT = re.compile(r"^\s*from\s+invariant\.detectors\s+import\s+(.+)$", re.M)
+DEFAULT_PRELOAD = ["pii"]
+
+SANDBOX_START_SECONDS = Histogram(
+    "invariant_server_sandbox_start_seconds",
+    "Time until a started sandbox accepts requests",
+    buckets=[0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300],
+)
+
 
 class IpcController:
     _instance = None
@@ -20,7 +33,35 @@ class IpcController:
     def _init(self):
         self.socket_path = "/tmp/sockets/invariant.sock"
         os.makedirs("/tmp/sockets", exist_ok=True)
-        self.start_process()
+        self.process = None
+        self.lock = asyncio.Lock()
+        self.in_flight = 0
+        self.last_activity = time.monotonic()
+        # detector name -> time it was last used by a policy
+        self.detectors_used = {}
+        self.scheduler = LaneScheduler(
+            settings.sandbox_concurrency, settings.lane_reserved, settings.lane_weights
+        )
+        # Remote workers replace the local sandbox when configured
+        self.workers = None
+        if settings.workers:
+            self.workers = WorkerPool(
+                settings.workers,
+                settings.worker_token,
+                settings.worker_tls_ca,
+                settings.worker_health_interval,
+            )
+
+    async def start(self):
+        if self.workers:
+            await self.workers.check_health()
+            return
+
+        # Locks are bound to an event loop, so a new one is needed per app lifespan
+        self.lock = asyncio.Lock()
+        async with self.lock:
+            if not self.exists():
+                await self.start_process()
 
     def exists(self):
         if not os.path.exists(self.socket_path):
@@ -45,30 +86,81 @@ class IpcController:
 
         return process and os.path.exists(self.socket_path)
 
-    async def request(self, message):
-        if not self.exists():
-            self.start_process()
-
-        reader, writer = await asyncio.open_unix_connection(self.socket_path)
-        writer.write(json.dumps(message).encode())
-        writer.write_eof()
-        await writer.drain()
-
-        response = await reader.read(10 * 1024 * 1024)
+    async def request(self, message, lane: str = BULK):
+        async with self.scheduler.slot(lane):
+            if self.workers:
+                return await self.workers.request(message)
+            return await self.local_request(message)
 
-        writer.close()
+    async def local_request(self, message):
+        self.in_flight += 1
         try:
-            await writer.wait_closed()
-        except BrokenPipeError:
-            pass
+            async with self.lock:
+                if not self.exists():
+                    await self.start_process()
+            self.record_detectors(message.get("policy", ""))
 
-        return json.loads(response.decode())
+            reader, writer = await asyncio.open_unix_connection(self.socket_path)
+            writer.write(json.dumps(message).encode())
+            writer.write_eof()
+            await writer.drain()
 
-    def start_process(self):
+            response = await reader.read()
+
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except BrokenPipeError:
+                pass
+
+            return json.loads(response.decode())
+        finally:
+            self.in_flight -= 1
+            self.last_activity = time.monotonic()
+
+    def record_detectors(self, policy: str):
+        now = time.monotonic()
+        for match in DETECTOR_IMPORT.finditer(policy):
+            for name in match.group(1).strip("() ").split(","):
+                name = name.split(" as ")[0].strip()
+                if name:
+                    self.detectors_used[name] = now
+
+    def recent_detectors(self):
+        if not self.detectors_used:
+            return DEFAULT_PRELOAD
+        since = time.monotonic() - settings.preload_window
+        return sorted(
+            name for name, used in self.detectors_used.items() if used >= since
+        )
+
+    async def monitor_workers(self):
+        if self.workers:
+            await self.workers.monitor()
+
+    async def stop_when_idle(self):
+        if self.workers or settings.idle_timeout <= 0:
+            return
+        while True:
+            await asyncio.sleep(min(60, settings.idle_timeout))
+            async with self.lock:
+                idle = time.monotonic() - self.last_activity
+                if (
+                    self.in_flight == 0
+                    and idle >= settings.idle_timeout
+                    and self.exists()
+                ):
+                    print(f"Stopping sandbox after {idle:.0f}s of inactivity")
+                    self.close()
+
+    async def start_process(self):
         # Remove existing socket file if it exists
         if os.path.exists(self.socket_path):
             os.remove(self.socket_path)
 
+        preload = self.recent_detectors()
+        timestart = time.monotonic()
+
         if settings.production:
             # This is only meant to be used in the production Docker container
             self.process = subprocess.Popen(
@@ -79,17 +171,40 @@ class IpcController:
                     "--",
                     "/home/app/.venv/bin/python3",
                     "/home/app/server/ipc/invariant-ipc.py",
+                    "--preload",
+                    ",".join(preload),
                 ]
             )
         else:
             self.process = subprocess.Popen(
-                [sys.executable, os.path.abspath(__file__ + "/../invariant-ipc.py")]
+                [
+                    sys.executable,
+                    os.path.abspath(__file__ + "/../invariant-ipc.py"),
+                    "--preload",
+                    ",".join(preload),
+                ]
             )
 
+        # The sandbox binds its socket only after preloading, so wait without
+        # blocking the event loop
         while not os.path.exists(self.socket_path):
-            time.sleep(0.1)
+            if self.process.poll() is not None:
+                raise RuntimeError(
+                    f"Sandbox exited during startup with code {self.process.returncode}"
+                )
+            if time.monotonic() - timestart > settings.sandbox_start_timeout:
+                self.close()
+                raise RuntimeError("Sandbox did not start in time")
+            await asyncio.sleep(0.1)
+
+        duration = time.monotonic() - timestart
+        SANDBOX_START_SECONDS.observe(duration)
+        print(f"Sandbox started in {duration:.1f}s (preloaded: {', '.join(preload)})")
 
     def close(self):
+        if self.workers:
+            return
+
         # Kill any existing process using the Unix socket
         for proc in psutil.process_iter():
             try:
@@ -100,6 +215,10 @@ class IpcController:
                         break
             except (psutil.AccessDenied, psutil.ZombieProcess, psutil.NoSuchProcess):
                 continue
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
         if os.path.exists(self.socket_path):
             os.remove(self.socket_path)
 
@@ -1,4 +1,9 @@
+import argparse
+import hmac
+import ipaddress
 import socket
+import ssl
+import struct
 import json
 import multiprocessing as mp
 import subprocess
@@ -13,39 +18,340 @@ from invariant.stdlib.invariant.nodes import Message
 
 from invariant.runtime.utils.code import CodeIssue
 from typing import List, Dict
+from urllib.parse import urlparse
 import os
 
 
-def analyze(policy: str, trace: List[Dict]):
+# Relative cost of calling each detector. Anything else (comparisons, regexes,
+# tool and type filters) is treated as cheap.
+DETECTOR_COSTS = {
+    "semgrep": 100,
+    "python_code": 100,
+    "llm": 100,
+    "prompt_injection": 50,
+    "moderated": 50,
+    "pii": 50,
+    "copyright": 20,
+    "secrets": 5,
+}
+
+# AST attributes that point at declarations, scopes or type information
+# rather than at subexpressions
+SKIP_ATTRIBUTES = {"id", "location", "type", "type_ref", "parent", "scope"}
+
+
+def ast_nodes(node, seen=None):
+    if seen is None:
+        seen = set()
+    if isinstance(node, (str, bytes, int, float, bool, type)) or id(node) in seen:
+        return
+    seen.add(id(node))
+    if isinstance(node, (list, tuple)):
+        for item in node:
+            yield from ast_nodes(item, seen)
+        return
+    if not hasattr(node, "__dict__"):
+        return
+    yield node
+    for key, value in vars(node).items():
+        if key not in SKIP_ATTRIBUTES:
+            yield from ast_nodes(value, seen)
+
+
+def conjunct_names(expr):
+    """Returns the variables a conjunct declares and the names it uses."""
+    declares, uses = set(), set()
+    for node in ast_nodes(expr):
+        kind = type(node).__name__
+        if kind == "TypedIdentifier":
+            declares.add(node.name)
+        elif kind == "Identifier":
+            uses.add(node.name)
+        elif kind == "BinaryExpr" and node.op == ":=":
+            declares.add(getattr(node.left, "name", None))
+    return declares, uses - declares
+
+
+def conjunct_cost(expr) -> int:
+    _, uses = conjunct_names(expr)
+    return 1 + sum(DETECTOR_COSTS.get(name, 0) for name in uses)
+
+
+def order_conjuncts(conditions: list) -> list:
+    # Cheap conjuncts go first, so that expensive detectors are only evaluated
+    # for models that a cheap conjunct has not already ruled out. A conjunct
+    # never moves ahead of the conjuncts declaring the variables it uses.
+    names = [conjunct_names(expr) for expr in conditions]
+    pending = list(range(len(conditions)))
+    ordered = []
+    while pending:
+        undeclared = set().union(*(names[i][0] for i in pending))
+        ready = [i for i in pending if not names[i][1] & undeclared]
+        index = min(
+            ready or pending[:1], key=lambda i: (conjunct_cost(conditions[i]), i)
+        )
+        pending.remove(index)
+        ordered.append(conditions[index])
+    return ordered
+
+
+def rule_cost(rule) -> int:
+    return sum(conjunct_cost(expr) for expr in rule.condition)
+
+
+def rule_groups(rules: list) -> list:
+    # Rules without detector calls are evaluated together, since evaluating
+    # them one by one would only rebuild the input once per rule. Rules with
+    # detectors follow one at a time, cheapest first.
+    rules = sorted(rules, key=rule_cost)
+    cheap = [rule for rule in rules if rule_cost(rule) == len(rule.condition)]
+    expensive = [[rule] for rule in rules if rule_cost(rule) > len(rule.condition)]
+    return ([cheap] if cheap else []) + expensive
+
+
+def first_violation(policy, evaluate) -> tuple:
+    """Evaluates the rules of ``policy`` in order of cost and stops at the
+    first group of rules that raises an error.
+
+    ``evaluate`` runs the policy and returns its errors and handled errors.
+    """
+    rules = list(policy.rule_set.rules)
+    for rule in rules:
+        rule.condition = order_conjuncts(rule.condition)
+
+    handled_errors = []
+    try:
+        for group in rule_groups(rules):
+            policy.rule_set.rules = group
+            errors, handled = evaluate()
+            handled_errors.extend(handled)
+            if errors:
+                return errors[:1], handled_errors
+    finally:
+        policy.rule_set.rules = rules
+    return [], handled_errors
+
+
+def event_constraint(expr):
+    """Matches conjuncts of the form ``var is tool:name``, ``var.role == "role"``
+    and ``var.role in ["role", ...]``, and returns the variable, the kind of
+    constraint and the values it allows."""
+    if type(expr).__name__ != "BinaryExpr":
+        return None
+    left, op, right = expr.left, expr.op, expr.right
+    if op == "is" and type(left).__name__ == "Identifier":
+        tool_ref = getattr(right, "tool_ref", right)
+        if type(tool_ref).__name__ == "ToolReference":
+            return left.name, "tool", {tool_ref.name}
+        return None
+
+    if op == "==" and type(left).__name__ == "StringLiteral":
+        left, right = right, left
+    if (
+        type(left).__name__ != "MemberAccess"
+        or left.member != "role"
+        or type(left.expr).__name__ != "Identifier"
+    ):
+        return None
+    if op == "==" and type(right).__name__ == "StringLiteral":
+        return left.expr.name, "role", {right.value}
+    if (
+        op == "in"
+        and type(right).__name__ == "ArrayLiteral"
+        and all(type(e).__name__ == "StringLiteral" for e in right.elements)
+    ):
+        return left.expr.name, "role", {e.value for e in right.elements}
+    return None
+
+
+def policy_relevance(policy: str):
+    """Returns the message roles and tool names of the events the policy can
+    match, or None if it may depend on any event.
+
+    Every message or tool call variable must be constrained by a top-level
+    conjunct of its rule; other event types, direct uses of ``input`` and
+    ``~>`` disable filtering. Dropping events keeps their order, which is all
+    ``->`` depends on, but makes events adjacent that were not before.
+    """
     policy = Policy.from_string(policy)
-    analysis_result = policy.analyze(trace)
+    for node in ast_nodes(getattr(policy, "policy_root", None)):
+        if type(node).__name__ == "Identifier" and node.name == "input":
+            return None
+        if type(node).__name__ == "BinaryExpr" and node.op == "~>":
+            return None
+
+    roles, tools = set(), set()
+    for rule in policy.rule_set.rules:
+        constraints = {}
+        for expr in rule.condition:
+            constraint = event_constraint(expr)
+            if constraint is not None:
+                name, kind, values = constraint
+                constraints[name, kind] = constraints.get((name, kind), values) & values
+
+        for node in ast_nodes(rule.condition):
+            if type(node).__name__ != "TypedIdentifier":
+                continue
+            type_name = getattr(node.type_ref, "name", node.type_ref)
+            if type_name == "Message" and (node.name, "role") in constraints:
+                roles |= constraints[node.name, "role"]
+            elif type_name == "ToolCall" and (node.name, "tool") in constraints:
+                tools |= constraints[node.name, "tool"]
+            else:
+                return None
+    return {"roles": sorted(roles), "tools": sorted(tools)}
+
+
+def analyze(
+    policy: str, trace: List[Dict], mode: str = "all", indices: List[int] | None = None
+):
+    policy = Policy.from_string(policy)
+    return analyze_trace(policy, trace, mode, indices)
+
+
+def analyze_batch(
+    policy: str,
+    traces: List[List[Dict]],
+    mode: str = "all",
+    indices: List[List[int] | None] | None = None,
+):
+    # the policy is parsed once and reused for every trace
+    policy = Policy.from_string(policy)
+    indices = indices or [None] * len(traces)
+    return [
+        analyze_trace(policy, trace, mode, trace_indices)
+        for trace, trace_indices in zip(traces, indices)
+    ]
+
+
+def analyze_trace(policy, trace: List[Dict], mode: str, indices: List[int] | None):
+    if mode != "first":
+        analysis_result = policy.analyze(trace)
+        return format_analysis(
+            analysis_result.errors, analysis_result.handled_errors, indices
+        )
+
+    def evaluate():
+        analysis_result = policy.analyze(trace)
+        return analysis_result.errors, analysis_result.handled_errors
+
+    return format_analysis(*first_violation(policy, evaluate), indices)
+
+
+def remap_trace_indices(errors: list, indices: List[int] | None):
+    """Points the events referenced by ``errors`` back to their position in
+    the trace before irrelevant events were filtered out."""
+    if indices is None:
+        return
+    seen = set()
+
+    def visit(value):
+        if isinstance(value, (str, bytes, int, float, bool, type)) or value is None:
+            return
+        if id(value) in seen:
+            return
+        seen.add(id(value))
+        if isinstance(value, (list, tuple, set)):
+            for item in value:
+                visit(item)
+            return
+        if isinstance(value, dict):
+            for item in value.values():
+                visit(item)
+            return
+        metadata = getattr(value, "metadata", None)
+        if isinstance(metadata, dict) and isinstance(metadata.get("trace_idx"), int):
+            metadata["trace_idx"] = indices[metadata["trace_idx"]]
+        if isinstance(value, BaseException):
+            visit(value.args)
+        if hasattr(value, "__dict__"):
+            for key, item in vars(value).items():
+                if key != "metadata":
+                    visit(item)
+
+    visit(errors)
+
+
+def remap_json_path(path: str, indices: List[int] | None) -> str:
+    if indices is None:
+        return path
+    index, _, rest = path.partition(".")
+    index, colon, span = index.partition(":")
+    if not index.isdigit():
+        return path
+    return str(indices[int(index)]) + colon + span + ("." if rest else "") + rest
+
+
+def format_analysis(errors, handled_errors, indices: List[int] | None = None):
+    remap_trace_indices([errors, handled_errors], indices)
     return {
         "errors": [
             {
                 "error": repr(error),
-                "ranges": ["messages." + r.json_path for r in error.ranges],
+                "ranges": [
+                    "messages." + remap_json_path(r.json_path, indices)
+                    for r in error.ranges
+                ],
             }
-            for error in analysis_result.errors
-        ],
-        "handled_errors": [
-            repr(handled_error) for handled_error in analysis_result.handled_errors
+            for error in errors
         ],
+        "handled_errors": [repr(handled_error) for handled_error in handled_errors],
     }
 
 
-def monitor_check(past_events: List[Dict], pending_events: List[Dict], policy: str):
+def monitor_check(
+    past_events: List[Dict],
+    pending_events: List[Dict],
+    policy: str,
+    mode: str = "all",
+    indices: List[int] | None = None,
+):
     monitor = Monitor.from_string(policy)
-    check_result = monitor.check(past_events, pending_events)
+    if mode == "first":
+        check_result, _ = first_violation(
+            monitor, lambda: (monitor.check(past_events, pending_events), [])
+        )
+    else:
+        check_result = monitor.check(past_events, pending_events)
+    remap_trace_indices(check_result, indices)
     return [repr(error) for error in check_result]
 
 
-def handle_request(data):
+# Answer to requests with a missing or wrong token, recognised by the server
+UNAUTHORIZED = "Unauthorized worker token"
+# Default limit for TCP request frames, matching the server's max_request_size
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+
+def handle_request(data, token: str | None = None):
     message = json.loads(data)
-    if message["type"] == "analyze":
-        result = analyze(message["policy"], message["trace"])
+    if token and not hmac.compare_digest(str(message.pop("token", "")), token):
+        raise PermissionError(UNAUTHORIZED)
+    if message["type"] == "ping":
+        result = "pong"
+    elif message["type"] == "relevance":
+        result = policy_relevance(message["policy"])
+    elif message["type"] == "analyze":
+        result = analyze(
+            message["policy"],
+            message["trace"],
+            message.get("mode", "all"),
+            message.get("indices"),
+        )
+    elif message["type"] == "analyze_batch":
+        result = analyze_batch(
+            message["policy"],
+            message["traces"],
+            message.get("mode", "all"),
+            message.get("indices"),
+        )
     elif message["type"] == "monitor_check":
         result = monitor_check(
-            message["past_events"], message["pending_events"], message["policy"]
+            message["past_events"],
+            message["pending_events"],
+            message["policy"],
+            message.get("mode", "all"),
+            message.get("indices"),
         )
     return json.dumps(result).encode()
 
@@ -66,6 +372,47 @@ def worker(client_socket):
         client_socket.close()
 
 
+def recv_exactly(client_socket, length: int) -> bytes:
+    data = bytearray()
+    while len(data) < length:
+        chunk = client_socket.recv(min(length - len(data), 1024 * 1024))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data += chunk
+    return bytes(data)
+
+
+def tcp_worker(client_socket, tls_context, token, max_frame_size=MAX_FRAME_SIZE):
+    # TCP messages are framed with an 8 byte length prefix, since TLS does not
+    # support half-closing the connection to mark the end of a request
+    try:
+        if tls_context is not None:
+            client_socket = tls_context.wrap_socket(client_socket, server_side=True)
+        (length,) = struct.unpack(">Q", recv_exactly(client_socket, 8))
+        if length > max_frame_size:
+            # the length is checked before the token, so it must not be trusted
+            raise ValueError(f"Request frame of {length} bytes is too large")
+        data = recv_exactly(client_socket, length)
+        try:
+            response = handle_request(data, token)
+        except Exception as e:
+            response = json.dumps(str(e)).encode()
+        client_socket.sendall(struct.pack(">Q", len(response)) + response)
+    except Exception:
+        pass
+    finally:
+        client_socket.close()
+
+
+def is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
 def detect_all(self, code: str, lang: str):
     temp_file = self.write_to_temp_file(code, lang)
     if lang == "python":
@@ -105,20 +452,75 @@ def detect_all(self, code: str, lang: str):
         issues.append(CodeIssue(description=description, severity=severity))
     return issues
 
-def run_pii_once(text):
-    policy = Policy.from_string("""
+PRELOAD_POLICIES = {
+    "pii": """
     from invariant.detectors import pii
 
     raise "found personal information in the trace" if:
         (msg: Message)
         any(pii(msg.content))
-    """)
-    return policy.analyze([{"role": "user", "content": "Hi there Alice!"}])
+    """,
+    "prompt_injection": """
+    from invariant.detectors import prompt_injection
+
+    raise "found prompt injection in the trace" if:
+        (msg: Message)
+        prompt_injection(msg.content)
+    """,
+    "moderated": """
+    from invariant.detectors import moderated
+
+    raise "found moderated content in the trace" if:
+        (msg: Message)
+        moderated(msg.content)
+    """,
+}
+
+
+def preload(detectors: List[str]):
+    # Load detector models once in the parent, so forked workers share them
+    for detector in detectors:
+        if detector not in PRELOAD_POLICIES:
+            continue
+        try:
+            policy = Policy.from_string(PRELOAD_POLICIES[detector])
+            policy.analyze([{"role": "user", "content": "Hi there Alice!"}])
+        except Exception as e:
+            print(f"Failed to preload {detector}: {e}")
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--preload", default="pii")
+    parser.add_argument(
+        "--listen",
+        help="serve on tcp://host:port instead of the local Unix socket",
+    )
+    parser.add_argument("--tls-cert", help="certificate for TLS on --listen")
+    parser.add_argument("--tls-key", help="private key for TLS on --listen")
+    parser.add_argument(
+        "--max-request-size",
+        type=int,
+        default=MAX_FRAME_SIZE,
+        help="largest request accepted on --listen, in bytes",
+    )
+    parser.add_argument(
+        "--insecure",
+        action="store_true",
+        help="allow --listen on a non-loopback address without INVARIANT_WORKER_TOKEN",
+    )
+    args = parser.parse_args()
+
+    if args.listen:
+        listen = urlparse(args.listen)
+        token = os.getenv("INVARIANT_WORKER_TOKEN") or None
+        if not token and not is_loopback(listen.hostname) and not args.insecure:
+            parser.error(
+                "--listen on a non-loopback address requires INVARIANT_WORKER_TOKEN "
+                "(or --insecure)"
+            )
+
     mp.set_start_method("fork")
-    server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-    socket_path = "/tmp/sockets/invariant.sock"
 
     nsjail = not not os.getenv("NSJAIL", False)
 
@@ -126,13 +528,34 @@ if __name__ == "__main__":
         from invariant.runtime.utils.code import SemgrepDetector
         SemgrepDetector.detect_all = detect_all
 
+    # Load models before binding, so the socket only appears once we are ready
+    preload([detector for detector in args.preload.split(",") if detector])
+
+    if args.listen:
+        tls_context = None
+        if args.tls_cert:
+            tls_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            tls_context.load_cert_chain(args.tls_cert, args.tls_key)
+
+        server_socket = socket.create_server(
+            (listen.hostname, listen.port), backlog=1024
+        )
+        while True:
+            client_sock, _ = server_socket.accept()
+            process = mp.Process(
+                target=tcp_worker,
+                args=(client_sock, tls_context, token, args.max_request_size),
+            )
+            process.start()
+            client_sock.close()
+
+    server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    socket_path = "/tmp/sockets/invariant.sock"
+
     # Ensure the socket does not already exist
     server_socket.bind(socket_path)
     server_socket.listen(1024)
 
-    # Run PII once to load
-    run_pii_once("My name is Alice!")
-
     while True:
         client_sock, _ = server_socket.accept()
         process = mp.Process(target=worker, args=(client_sock,))
@@ -0,0 +1,153 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict
+from prometheus_client import Gauge, Histogram
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+
+LANE_QUEUE_DEPTH = Gauge(
+    "invariant_server_lane_queue_depth",
+    "Sandbox requests waiting for a slot",
+    ["lane"],
+)
+LANE_ACTIVE = Gauge(
+    "invariant_server_lane_active",
+    "Sandbox requests currently being evaluated",
+    ["lane"],
+)
+LANE_WAIT_SECONDS = Histogram(
+    "invariant_server_lane_wait_seconds",
+    "Time sandbox requests waited for a slot",
+    ["lane"],
+    buckets=[0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30],
+)
+
+
+class _Lane:
+    def __init__(self, name: str, reserved: int, weight: int):
+        self.name = name
+        self.reserved = reserved
+        self.weight = max(1, weight)
+        self.active = 0
+        self.waiting = deque()
+        # stride scheduling: the eligible lane with the lowest pass goes next
+        self.pass_ = 0.0
+
+
+class LaneScheduler:
+    """Admits sandbox requests from several lanes into a fixed number of slots.
+
+    Each lane has ``reserved`` slots that only it can use. The remaining slots
+    are shared, and handed out to waiting lanes in proportion to their
+    weights. A capacity of 0 disables scheduling. Reservations that do not
+    fit into the capacity are scaled down.
+    """
+
+    def __init__(
+        self, capacity: int, reserved: Dict[str, int], weights: Dict[str, int]
+    ):
+        self.capacity = capacity
+        reserved = {name: max(0, reserved.get(name, 0)) for name in LANES}
+        # lanes without reserved slots can only ever run in a shared slot
+        limit = capacity - 1 if 0 in reserved.values() else capacity
+        total = sum(reserved.values())
+        if capacity > 0 and total > limit:
+            reserved = {
+                name: count * limit // total for name, count in reserved.items()
+            }
+            print(
+                f"Reserved lane slots exceed the sandbox concurrency of {capacity}, "
+                f"scaled down to {reserved}"
+            )
+        self.lanes = {
+            name: _Lane(name, reserved[name], weights.get(name, 1)) for name in LANES
+        }
+        self.shared = max(
+            0, capacity - sum(lane.reserved for lane in self.lanes.values())
+        )
+
+    def _shared_in_use(self) -> int:
+        return sum(max(0, lane.active - lane.reserved) for lane in self.lanes.values())
+
+    def _can_start(self, lane: _Lane) -> bool:
+        if sum(other.active for other in self.lanes.values()) >= self.capacity:
+            return False
+        return lane.active < lane.reserved or self._shared_in_use() < self.shared
+
+    def _dispatch(self):
+        while True:
+            eligible = [
+                lane
+                for lane in self.lanes.values()
+                if lane.waiting and self._can_start(lane)
+            ]
+            if not eligible:
+                return
+            lane = min(eligible, key=lambda lane: lane.pass_)
+            future = lane.waiting.popleft()
+            LANE_QUEUE_DEPTH.labels(lane.name).set(len(lane.waiting))
+            if future.done():
+                continue
+            lane.active += 1
+            lane.pass_ += 1 / lane.weight
+            LANE_ACTIVE.labels(lane.name).set(lane.active)
+            future.set_result(None)
+
+    def _release(self, lane: _Lane):
+        lane.active -= 1
+        LANE_ACTIVE.labels(lane.name).set(lane.active)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, name: str):
+        if self.capacity <= 0:
+            yield
+            return
+
+        lane = self.lanes[name]
+        if not lane.waiting:
+            # a lane that was idle must not catch up on the turns it skipped
+            busy = [
+                other.pass_
+                for other in self.lanes.values()
+                if other.waiting and other is not lane
+            ]
+            if busy:
+                lane.pass_ = max(lane.pass_, min(busy))
+
+        future = asyncio.get_running_loop().create_future()
+        lane.waiting.append(future)
+        LANE_QUEUE_DEPTH.labels(lane.name).set(len(lane.waiting))
+        timestart = time.monotonic()
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # the slot was granted just before the cancellation
+                self._release(lane)
+            elif future in lane.waiting:
+                lane.waiting.remove(future)
+                LANE_QUEUE_DEPTH.labels(lane.name).set(len(lane.waiting))
+            raise
+        LANE_WAIT_SECONDS.labels(lane.name).observe(time.monotonic() - timestart)
+
+        try:
+            yield
+        finally:
+            self._release(lane)
+
+
+def parse_lane(priority: str | None, default: str) -> str:
+    if priority is None:
+        return default
+    lane = priority.strip().lower()
+    if lane not in LANES:
+        raise ValueError(
+            f"Invalid priority {priority!r}, expected one of: {', '.join(LANES)}"
+        )
+    return lane
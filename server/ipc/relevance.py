@@ -0,0 +1,77 @@
+import bisect
+from asyncache import cached
+from cachetools import LRUCache
+from cachetools.keys import hashkey
+from prometheus_client import Counter
+from typing import Dict, List, Optional, Tuple
+from server.config import settings
+
+RELEVANCE_EVENTS = Counter(
+    "invariant_server_relevance_events",
+    "Trace events sent to the sandbox or dropped as irrelevant to the policy",
+    ["outcome"],
+)
+
+
+@cached(LRUCache(128), key=lambda ipc, policy, lane: hashkey(policy))
+async def cached_relevance(ipc, policy: str, lane: str):
+    result = await ipc.request({"type": "relevance", "policy": policy}, lane)
+    # the sandbox answers with a string for errors, e.g. policies that do not parse
+    return result if isinstance(result, dict) else None
+
+
+async def policy_relevance(ipc, policy: str, lane: str) -> Optional[Dict]:
+    """Returns the roles and tool names of the events ``policy`` can match, or
+    None if every event has to be sent."""
+    if not settings.relevance_filter:
+        return None
+    try:
+        return await cached_relevance(ipc, policy, lane)
+    except Exception:
+        # not cached, the request itself will report a broken sandbox
+        return None
+
+
+def is_relevant(event, relevance: Dict) -> bool:
+    if not isinstance(event, dict):
+        return True
+    if event.get("role") in relevance["roles"]:
+        return True
+    calls = [event] if "function" in event else event.get("tool_calls") or []
+    return any(
+        isinstance(call, dict)
+        and isinstance(call.get("function"), dict)
+        and call["function"].get("name") in relevance["tools"]
+        for call in calls
+    )
+
+
+def filter_events(
+    events: List[Dict], relevance: Optional[Dict]
+) -> Tuple[List[Dict], Optional[List[int]]]:
+    """Drops the events the policy cannot match.
+
+    The remaining events keep their relative order, which is all that ``->``
+    depends on. Also returns the original index of every remaining event, or
+    None if nothing was dropped.
+    """
+    if relevance is None:
+        return events, None
+    indices = [i for i, event in enumerate(events) if is_relevant(event, relevance)]
+    RELEVANCE_EVENTS.labels("sent").inc(len(indices))
+    RELEVANCE_EVENTS.labels("dropped").inc(len(events) - len(indices))
+    if len(indices) == len(events):
+        return events, None
+    return [events[i] for i in indices], indices
+
+
+def filter_monitor_events(
+    past_events: List[Dict], pending_events: List[Dict], relevance: Optional[Dict]
+) -> Tuple[List[Dict], List[Dict], Optional[List[int]]]:
+    """Like ``filter_events`` for the past and pending events of a monitor
+    check, with indices into the concatenation of both."""
+    events, indices = filter_events(past_events + pending_events, relevance)
+    if indices is None:
+        return past_events, pending_events, None
+    split = bisect.bisect_left(indices, len(past_events))
+    return events[:split], events[split:], indices
@@ -0,0 +1,145 @@
+import asyncio
+import itertools
+import json
+import ssl
+import struct
+from typing import List
+from urllib.parse import urlparse
+from prometheus_client import Gauge
+
+WORKER_UP = Gauge(
+    "invariant_server_worker_up",
+    "Whether a remote sandbox worker passed its last health check",
+    ["endpoint"],
+)
+
+
+# Must match the answer of invariant-ipc.py to a missing or wrong token
+UNAUTHORIZED = "Unauthorized worker token"
+
+
+class WorkerUnavailable(ConnectionError):
+    pass
+
+
+class WorkerUnauthorized(PermissionError):
+    pass
+
+
+class WorkerEndpoint:
+    def __init__(self, url: str, token: str = "", tls_ca: str | None = None):
+        parsed = urlparse(url)
+        if (
+            parsed.scheme not in ("tcp", "tls")
+            or not parsed.hostname
+            or not parsed.port
+        ):
+            raise ValueError(f"Invalid worker endpoint: {url}")
+        self.url = url
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.token = token
+        self.ssl = None
+        if parsed.scheme == "tls":
+            self.ssl = ssl.create_default_context(cafile=tls_ca)
+        self.healthy = True
+
+    def set_healthy(self, healthy: bool):
+        self.healthy = healthy
+        WORKER_UP.labels(self.url).set(1 if healthy else 0)
+
+    async def request(self, message, connect_timeout: float = 5.0):
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(
+                    self.host,
+                    self.port,
+                    ssl=self.ssl,
+                    server_hostname=self.host if self.ssl else None,
+                ),
+                connect_timeout,
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            raise WorkerUnavailable(f"{self.url}: {str(e) or type(e).__name__}") from e
+        try:
+            if self.token:
+                message = {**message, "token": self.token}
+            payload = json.dumps(message).encode()
+            writer.write(struct.pack(">Q", len(payload)) + payload)
+            await writer.drain()
+
+            (length,) = struct.unpack(">Q", await reader.readexactly(8))
+            response = await reader.readexactly(length)
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (BrokenPipeError, ConnectionError, ssl.SSLError):
+                pass
+
+        result = json.loads(response.decode())
+        if result == UNAUTHORIZED:
+            raise WorkerUnauthorized(f"{self.url}: worker rejected the token")
+        return result
+
+    async def ping(self, timeout: float) -> bool:
+        try:
+            return (
+                await asyncio.wait_for(self.request({"type": "ping"}), timeout)
+                == "pong"
+            )
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+            return False
+
+
+class WorkerPool:
+    """Routes sandbox requests round-robin over remote workers.
+
+    Workers that refuse a connection or fail a health check are skipped until
+    they pass a health check again.
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        token: str = "",
+        tls_ca: str | None = None,
+        health_interval: float = 10,
+    ):
+        self.endpoints = [WorkerEndpoint(url, token, tls_ca) for url in urls]
+        self.health_interval = health_interval
+        self._next = itertools.cycle(range(len(self.endpoints)))
+
+    def candidates(self) -> List[WorkerEndpoint]:
+        start = next(self._next)
+        ordered = self.endpoints[start:] + self.endpoints[:start]
+        healthy = [endpoint for endpoint in ordered if endpoint.healthy]
+        # when every worker looks down, try them all rather than fail outright
+        return healthy or ordered
+
+    async def request(self, message):
+        errors = []
+        for endpoint in self.candidates():
+            # Only failures to connect are retried elsewhere: a request that
+            # breaks a worker mid-evaluation would likely break the next one too
+            try:
+                return await endpoint.request(message)
+            except WorkerUnavailable as e:
+                endpoint.set_healthy(False)
+                errors.append(str(e))
+        raise RuntimeError("No sandbox worker available (" + "; ".join(errors) + ")")
+
+    async def check_health(self):
+        results = await asyncio.gather(
+            *[
+                endpoint.ping(timeout=max(1, self.health_interval / 2))
+                for endpoint in self.endpoints
+            ]
+        )
+        for endpoint, healthy in zip(self.endpoints, results):
+            endpoint.set_healthy(healthy)
+
+    async def monitor(self):
+        while True:
+            await self.check_health()
+            await asyncio.sleep(self.health_interval)
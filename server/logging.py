@@ -1,8 +1,28 @@
 import aiosqlite
+import argparse
+import asyncio
+import time
+from typing import List, Optional
+from server.config import settings
+from server.utils import percentile
+
+DATABASE = "server/logs/logs.db"
+
+# Minutes that are this recent are recomputed on every rollup, so requests
+# that are logged only after they finish still end up in their start minute.
+ROLLUP_DELAY = 5 * 60
+# Seconds of requests that are rolled up per query
+ROLLUP_WINDOW = 60 * 60
+PRUNE_BATCH_SIZE = 10000
 
 
 async def init():
-    async with aiosqlite.connect("server/logs/logs.db") as db:
+    async with aiosqlite.connect(DATABASE) as db:
+        # auto_vacuum only takes effect on an empty database here; existing
+        # databases are converted by the vacuum migration below
+        await db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        await db.execute("PRAGMA journal_mode = WAL")
+
         # Create the request_bodies table
         await db.execute(
             """CREATE TABLE IF NOT EXISTS request_bodies (
@@ -27,9 +47,51 @@ async def init():
                 FOREIGN KEY (body_hash) REFERENCES request_bodies(hash)
             )"""
         )
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS requests_timestamp_start ON requests (timestamp_start)"
+        )
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS requests_path ON requests (path, timestamp_start)"
+        )
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS requests_status_code ON requests (status_code)"
+        )
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS requests_body_hash ON requests (body_hash)"
+        )
+        # Create the per-minute latency rollup table
+        await db.execute(
+            """CREATE TABLE IF NOT EXISTS request_rollups (
+                minute INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                errors INTEGER NOT NULL,
+                p50 REAL NOT NULL,
+                p95 REAL NOT NULL,
+                p99 REAL NOT NULL,
+                PRIMARY KEY (minute, path)
+            )"""
+        )
 
         await db.commit()
 
+        async with db.execute("PRAGMA auto_vacuum") as cursor:
+            (auto_vacuum,) = await cursor.fetchone()
+        if auto_vacuum != 2:
+            print(
+                "Pruned logs do not shrink logs.db until it is migrated with "
+                "`python -m server.logging vacuum` (requires downtime and free "
+                "disk space for a copy of the database)"
+            )
+
+
+async def vacuum(database: Optional[str] = None):
+    """Rebuilds the database with incremental auto vacuum, so that pruning
+    returns free pages to the file system."""
+    async with aiosqlite.connect(database or DATABASE) as db:
+        await db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        await db.execute("VACUUM")
+
 
 async def log_request(
     method: str,
@@ -43,7 +105,7 @@ async def log_request(
     status_code: int,
     response: str,
 ):
-    async with aiosqlite.connect("server/logs/logs.db") as db:
+    async with aiosqlite.connect(DATABASE) as db:
         try:
             await db.execute(
                 """INSERT OR IGNORE INTO request_bodies (hash, content) VALUES (?, ?)""",
@@ -70,3 +132,160 @@ async def log_request(
             ),
         )
         await db.commit()
+
+
+async def rollup_window(db, start: int, end: int):
+    durations = {}
+    async with db.execute(
+        """SELECT timestamp_start - timestamp_start % 60, path, request_duration, status_code
+           FROM requests WHERE timestamp_start >= ? AND timestamp_start < ?""",
+        (start, end),
+    ) as cursor:
+        async for minute, path, duration, status_code in cursor:
+            durations.setdefault((minute, path), []).append((duration, status_code))
+
+    rows = []
+    for (minute, path), samples in durations.items():
+        values = sorted(duration for duration, _ in samples)
+        errors = sum(1 for _, status_code in samples if status_code >= 500)
+        rows.append(
+            (
+                minute,
+                path,
+                len(values),
+                errors,
+                percentile(values, 50),
+                percentile(values, 95),
+                percentile(values, 99),
+            )
+        )
+    await db.executemany(
+        """INSERT OR REPLACE INTO request_rollups (
+            minute, path, count, errors, p50, p95, p99
+        ) VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        rows,
+    )
+    await db.commit()
+
+
+async def rollup(now: float | None = None):
+    now = int(now if now is not None else time.time())
+    # only complete minutes are rolled up
+    end = now - now % 60
+
+    async with aiosqlite.connect(DATABASE) as db:
+        async with db.execute("SELECT MAX(minute) FROM request_rollups") as cursor:
+            (last,) = await cursor.fetchone()
+        if last is not None:
+            start = last - ROLLUP_DELAY
+        else:
+            async with db.execute(
+                "SELECT MIN(timestamp_start) FROM requests"
+            ) as cursor:
+                (first,) = await cursor.fetchone()
+            if first is None:
+                return
+            start = first
+        # rows and rollups older than their retention are pruned anyway, so the
+        # first rollup of an existing database does not backfill them
+        for retention in (settings.log_retention, settings.log_rollup_retention):
+            if retention > 0:
+                start = max(start, now - retention)
+        start -= start % 60
+
+        # the backfill of a large database is read one window at a time
+        for window in range(start, end, ROLLUP_WINDOW):
+            await rollup_window(db, window, min(window + ROLLUP_WINDOW, end))
+
+
+async def prune(now: float | None = None):
+    now = int(now if now is not None else time.time())
+
+    async with aiosqlite.connect(DATABASE) as db:
+        if settings.log_retention > 0:
+            # delete in batches to keep write locks short
+            while True:
+                cursor = await db.execute(
+                    """DELETE FROM requests WHERE id IN (
+                        SELECT id FROM requests WHERE timestamp_start < ? LIMIT ?
+                    )""",
+                    (now - settings.log_retention, PRUNE_BATCH_SIZE),
+                )
+                await db.commit()
+                if cursor.rowcount < PRUNE_BATCH_SIZE:
+                    break
+
+        if settings.log_rollup_retention > 0:
+            await db.execute(
+                "DELETE FROM request_rollups WHERE minute < ?",
+                (now - settings.log_rollup_retention,),
+            )
+
+        while True:
+            cursor = await db.execute(
+                """DELETE FROM request_bodies WHERE hash IN (
+                    SELECT hash FROM request_bodies WHERE NOT EXISTS (
+                        SELECT 1 FROM requests WHERE requests.body_hash = request_bodies.hash
+                    ) LIMIT ?
+                )""",
+                (PRUNE_BATCH_SIZE,),
+            )
+            await db.commit()
+            if cursor.rowcount < PRUNE_BATCH_SIZE:
+                break
+        # the pragma frees one page per step, so it has to be fetched to completion
+        async with db.execute("PRAGMA incremental_vacuum") as cursor:
+            await cursor.fetchall()
+
+
+async def maintenance():
+    last_prune = None
+    while True:
+        try:
+            # prune first, so the first rollup does not read expired rows
+            if (
+                last_prune is None
+                or time.monotonic() - last_prune >= settings.log_prune_interval
+            ):
+                await prune()
+                last_prune = time.monotonic()
+            await rollup()
+        except Exception as e:
+            print(f"Log maintenance failed: {e}")
+        await asyncio.sleep(60)
+
+
+async def latency_stats(since: int, until: int, path: str | None = None):
+    query = """SELECT minute, path, count, errors, p50, p95, p99 FROM request_rollups
+               WHERE minute >= ? AND minute < ?"""
+    params = [since, until]
+    if path is not None:
+        query += " AND path = ?"
+        params.append(path)
+    query += " ORDER BY minute, path"
+
+    async with aiosqlite.connect(DATABASE) as db:
+        db.row_factory = aiosqlite.Row
+        async with db.execute(query, params) as cursor:
+            return [dict(row) async for row in cursor]
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m server.logging",
+        description="Maintenance commands for the request log.",
+    )
+    parser.add_argument(
+        "command",
+        choices=["vacuum"],
+        help="vacuum: convert logs.db to incremental auto vacuum (run with the server stopped)",
+    )
+    parser.add_argument("--db", default=DATABASE, help="path to logs.db")
+    args = parser.parse_args(argv)
+
+    if args.command == "vacuum":
+        asyncio.run(vacuum(args.db))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,16 @@
 from fastapi import Depends, FastAPI, HTTPException, Request
-from server.routers import policy, monitor
+from server.routers import policy, monitor, stats
 from server.ipc.controller import get_ipc_controller
 from fastapi.staticfiles import StaticFiles
+from fastapi.middleware.gzip import GZipMiddleware
 from starlette.middleware.base import BaseHTTPMiddleware
 from prometheus_fastapi_instrumentator import Instrumentator, metrics
 from prometheus_fastapi_instrumentator.metrics import Info
 from prometheus_client import Gauge
 from contextlib import asynccontextmanager
 from server import logging
+from server.compression import DecompressRequestMiddleware, ResponseSizeMiddleware
+import asyncio
 import os
 import psutil
 import hashlib
@@ -31,8 +34,15 @@ class HashRequestBodyMiddleware(BaseHTTPMiddleware):
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await logging.init()
+    maintenance = asyncio.create_task(logging.maintenance())
     ipc = get_ipc_controller()
+    await ipc.start()
+    idle = asyncio.create_task(ipc.stop_when_idle())
+    health = asyncio.create_task(ipc.monitor_workers())
     yield
+    health.cancel()
+    idle.cancel()
+    maintenance.cancel()
     ipc.close()
 
 
@@ -89,9 +99,21 @@ Instrumentator(excluded_handlers=["/metrics"]).add(
     )
 ).add(system_usage()).instrument(app).expose(app, dependencies=[Depends(auth_metrics)])
 
+# Middleware added last runs first: request bodies are decoded before they are
+# hashed, and response sizes are recorded before and after gzip compression.
+app.add_middleware(ResponseSizeMiddleware, size="uncompressed")
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+app.add_middleware(ResponseSizeMiddleware, size="compressed")
 app.add_middleware(HashRequestBodyMiddleware)
+app.add_middleware(DecompressRequestMiddleware)
 
 app.include_router(policy.router, prefix="/api/policy", tags=["policy"])
 app.include_router(monitor.router, prefix="/api/monitor", tags=["monitor"])
+app.include_router(
+    stats.router,
+    prefix="/api/stats",
+    tags=["stats"],
+    dependencies=[Depends(auth_metrics)],
+)
 
 app.mount("/", StaticFiles(directory="playground/dist/", html=True), name="assets")
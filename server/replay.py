@@ -0,0 +1,290 @@
+"""Replay requests recorded in the request log against a running server.
+
+Usage:
+    python -m server.replay --target http://127.0.0.1:8000 \\
+        --since 2024-09-01T00:00:00 --until 2024-09-01T01:00:00 --speed 4
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import List, Optional
+
+import aiosqlite
+import httpx
+
+from server.logging import DATABASE
+from server.utils import percentile
+
+
+@dataclass
+class RecordedRequest:
+    id: int
+    method: str
+    path: str
+    timestamp_start: int
+    request_duration: float
+    status_code: int
+    response: str
+    body: str
+
+
+@dataclass
+class ReplayResult:
+    request: RecordedRequest
+    status_code: Optional[int] = None
+    response: Optional[str] = None
+    duration: Optional[float] = None
+    error: Optional[str] = None
+
+    @property
+    def status_matches(self) -> bool:
+        return self.status_code == self.request.status_code
+
+    @property
+    def response_matches(self) -> bool:
+        if self.response is None:
+            return False
+        try:
+            return json.loads(self.response) == json.loads(self.request.response)
+        except ValueError:
+            return self.response == self.request.response
+
+    @property
+    def latency_delta(self) -> Optional[float]:
+        if self.duration is None:
+            return None
+        return self.duration - self.request.request_duration
+
+
+@dataclass
+class ReplayReport:
+    results: List[ReplayResult] = field(default_factory=list)
+
+    @property
+    def failed(self) -> List[ReplayResult]:
+        return [r for r in self.results if r.error is not None]
+
+    @property
+    def status_mismatches(self) -> List[ReplayResult]:
+        return [r for r in self.results if r.error is None and not r.status_matches]
+
+    @property
+    def response_mismatches(self) -> List[ReplayResult]:
+        return [
+            r
+            for r in self.results
+            if r.error is None and r.status_matches and not r.response_matches
+        ]
+
+    def latency_deltas(self) -> List[float]:
+        return [r.latency_delta for r in self.results if r.latency_delta is not None]
+
+    def summary(self) -> dict:
+        deltas = sorted(self.latency_deltas())
+        return {
+            "replayed": len(self.results),
+            "failed": len(self.failed),
+            "status_mismatches": len(self.status_mismatches),
+            "response_mismatches": len(self.response_mismatches),
+            "latency_delta": {
+                "mean": statistics.fmean(deltas) if deltas else None,
+                "p50": percentile(deltas, 50),
+                "p95": percentile(deltas, 95),
+                "p99": percentile(deltas, 99),
+            },
+        }
+
+
+def parse_timestamp(value: str) -> int:
+    try:
+        return int(float(value))
+    except ValueError:
+        pass
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+
+async def load_requests(
+    database: str = DATABASE,
+    since: Optional[int] = None,
+    until: Optional[int] = None,
+    paths: Optional[List[str]] = None,
+    limit: Optional[int] = None,
+) -> List[RecordedRequest]:
+    query = """SELECT r.id, r.method, r.path, r.timestamp_start, r.request_duration,
+                      r.status_code, r.response, b.content
+               FROM requests r JOIN request_bodies b ON r.body_hash = b.hash
+               WHERE 1 = 1"""
+    params = []
+    if since is not None:
+        query += " AND r.timestamp_start >= ?"
+        params.append(since)
+    if until is not None:
+        query += " AND r.timestamp_start < ?"
+        params.append(until)
+    if paths:
+        query += f" AND r.path IN ({', '.join('?' for _ in paths)})"
+        params.extend(paths)
+    query += " ORDER BY r.timestamp_start, r.id"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+
+    async with aiosqlite.connect(database) as db:
+        async with db.execute(query, params) as cursor:
+            rows = await cursor.fetchall()
+    return [RecordedRequest(*row) for row in rows]
+
+
+async def replay_one(
+    client: httpx.AsyncClient, request: RecordedRequest, headers: dict
+) -> ReplayResult:
+    result = ReplayResult(request)
+    start = time.perf_counter()
+    try:
+        response = await client.request(
+            request.method,
+            request.path,
+            content=request.body.encode("utf-8"),
+            headers=headers,
+        )
+        result.status_code = response.status_code
+        result.response = response.text
+    except httpx.HTTPError as e:
+        result.error = str(e) or type(e).__name__
+    result.duration = time.perf_counter() - start
+    return result
+
+
+async def replay(
+    requests: List[RecordedRequest],
+    target: str,
+    speed: float = 1.0,
+    no_cache: bool = False,
+    concurrency: int = 64,
+    timeout: float = 60.0,
+    client: Optional[httpx.AsyncClient] = None,
+) -> ReplayReport:
+    """Replay ``requests`` against ``target``.
+
+    Requests are sent at their recorded offsets divided by ``speed``; a speed of
+    0 sends them back to back, limited only by ``concurrency``.
+    """
+    headers = {"content-type": "application/json", "user-agent": "invariant-replay"}
+    if no_cache:
+        headers["cache-control"] = "no-cache"
+
+    semaphore = asyncio.Semaphore(concurrency)
+    owns_client = client is None
+    if owns_client:
+        client = httpx.AsyncClient(
+            base_url=target,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=concurrency),
+        )
+
+    async def scheduled(request: RecordedRequest, delay: float) -> ReplayResult:
+        if delay > 0:
+            await asyncio.sleep(delay)
+        async with semaphore:
+            return await replay_one(client, request, headers)
+
+    try:
+        tasks = []
+        if requests:
+            origin = requests[0].timestamp_start
+            started = time.monotonic()
+            for request in requests:
+                offset = (request.timestamp_start - origin) / speed if speed > 0 else 0
+                delay = offset - (time.monotonic() - started)
+                tasks.append(asyncio.create_task(scheduled(request, delay)))
+        results = await asyncio.gather(*tasks)
+    finally:
+        if owns_client:
+            await client.aclose()
+
+    return ReplayReport(list(results))
+
+
+def print_report(report: ReplayReport, verbose: bool = False):
+    summary = report.summary()
+    print(f"replayed:            {summary['replayed']}")
+    print(f"failed:              {summary['failed']}")
+    print(f"status mismatches:   {summary['status_mismatches']}")
+    print(f"response mismatches: {summary['response_mismatches']}")
+    for key, value in summary["latency_delta"].items():
+        label = f"latency delta {key}:"
+        print(f"{label:<21}{'-' if value is None else f'{value * 1000:+.1f} ms'}")
+
+    if verbose:
+        for result in report.failed:
+            print(f"#{result.request.id} {result.request.path}: {result.error}")
+        for result in report.status_mismatches:
+            print(
+                f"#{result.request.id} {result.request.path}: status "
+                f"{result.request.status_code} -> {result.status_code}"
+            )
+        for result in report.response_mismatches:
+            print(f"#{result.request.id} {result.request.path}: response differs")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m server.replay",
+        description="Replay requests from the request log against a server.",
+    )
+    parser.add_argument("--target", default="http://127.0.0.1:8000")
+    parser.add_argument("--db", default=DATABASE, help="path to logs.db")
+    parser.add_argument(
+        "--since", type=parse_timestamp, help="unix timestamp or ISO 8601 (UTC)"
+    )
+    parser.add_argument(
+        "--until", type=parse_timestamp, help="unix timestamp or ISO 8601 (UTC)"
+    )
+    parser.add_argument(
+        "--path", action="append", dest="paths", help="only replay this path"
+    )
+    parser.add_argument("--limit", type=int)
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="replay at N times the recorded rate, 0 for as fast as possible",
+    )
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument(
+        "--no-cache", action="store_true", help="bypass the server response cache"
+    )
+    parser.add_argument("--json", action="store_true", help="print summary as JSON")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    requests = asyncio.run(
+        load_requests(args.db, args.since, args.until, args.paths, args.limit)
+    )
+    report = asyncio.run(
+        replay(
+            requests,
+            args.target,
+            speed=args.speed,
+            no_cache=args.no_cache,
+            concurrency=args.concurrency,
+            timeout=args.timeout,
+        )
+    )
+    if args.json:
+        print(json.dumps(report.summary(), indent=2))
+    else:
+        print_report(report, verbose=args.verbose)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,37 +1,84 @@
 from cachetools import LRUCache
 from asyncache import cached
 from cachetools.keys import hashkey
-from fastapi import APIRouter, Depends, HTTPException, Request, Header
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Request,
+    Header,
+    WebSocket,
+    WebSocketDisconnect,
+)
+from pydantic import ValidationError
 from server.logging import log_request
 from datetime import datetime, timezone
+import asyncio
 import json
 from server import schemas
+from server.config import settings
 from server.ipc.controller import IpcController, get_ipc_controller
+from server.ipc.lanes import INTERACTIVE, parse_lane
+from server.ipc.relevance import filter_monitor_events, policy_relevance
 from typing import List, Dict
 
 router = APIRouter()
 
+# Checks a single session may have in flight before reading further events.
+MAX_PIPELINE_DEPTH = 32
 
-@cached(
-    LRUCache(128),
-    key=lambda body_hash, ipc, policy, past_events, pending_events: hashkey(body_hash),
-)
-async def cached_check(
-    body_hash: str,
+# raised by receive_json for frames that are not JSON (or not text)
+INVALID_JSON = (ValueError, KeyError, TypeError)
+
+# close code for sessions whose history outgrows max_request_size
+MESSAGE_TOO_BIG = 1009
+
+
+def events_size(events: List[Dict]) -> int:
+    return len(json.dumps(events))
+
+
+async def check_events(
     ipc: IpcController,
     policy: str,
     past_events: List[Dict],
     pending_events: List[Dict],
+    mode: str,
+    lane: str,
 ):
-    result = await ipc.request(
+    relevance = await policy_relevance(ipc, policy, lane)
+    past_events, pending_events, indices = filter_monitor_events(
+        past_events, pending_events, relevance
+    )
+    return await ipc.request(
         {
             "type": "monitor_check",
             "past_events": past_events,
             "pending_events": pending_events,
             "policy": policy,
-        }
+            "mode": mode,
+            "indices": indices,
+        },
+        lane,
     )
-    return result
+
+
+@cached(
+    LRUCache(128),
+    key=lambda body_hash, ipc, policy, past_events, pending_events, mode, lane: hashkey(
+        body_hash
+    ),
+)
+async def cached_check(
+    body_hash: str,
+    ipc: IpcController,
+    policy: str,
+    past_events: List[Dict],
+    pending_events: List[Dict],
+    mode: str,
+    lane: str,
+):
+    return await check_events(ipc, policy, past_events, pending_events, mode, lane)
 
 
 @router.post("/check")
@@ -40,19 +87,24 @@ async def monitor_check(
     data: schemas.MonitorCheck,
     ipc: IpcController = Depends(get_ipc_controller),
     cache_control: str | None = Header(None),
+    x_invariant_priority: str | None = Header(None),
 ):
+    try:
+        lane = parse_lane(x_invariant_priority, INTERACTIVE)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     timestart = datetime.now(timezone.utc).timestamp()
     status_code = 200
     result = {}
     try:
         if cache_control == "no-cache":
-            result = await ipc.request(
-                {
-                    "type": "monitor_check",
-                    "past_events": data.past_events,
-                    "pending_events": data.pending_events,
-                    "policy": data.policy,
-                }
+            result = await check_events(
+                ipc,
+                data.policy,
+                data.past_events,
+                data.pending_events,
+                data.mode,
+                lane,
             )
         else:
             result = await cached_check(
@@ -61,6 +113,8 @@ async def monitor_check(
                 data.policy,
                 data.past_events,
                 data.pending_events,
+                data.mode,
+                lane,
             )
         return result
     except Exception as e:
@@ -82,3 +136,88 @@ async def monitor_check(
             status_code,
             response,
         )
+
+
+@router.websocket("/session")
+async def monitor_session(
+    websocket: WebSocket, ipc: IpcController = Depends(get_ipc_controller)
+):
+    await websocket.accept()
+    try:
+        session = schemas.MonitorSession.model_validate(await websocket.receive_json())
+    except ValidationError as e:
+        await websocket.close(code=1008, reason=str(e)[:120])
+        return
+    except INVALID_JSON as e:
+        await websocket.close(code=1003, reason=f"Invalid JSON: {e}"[:120])
+        return
+    except WebSocketDisconnect:
+        return
+
+    past_events = list(session.past_events)
+    # the session bypasses the request body limit, so the history is held to it
+    history_size = events_size(past_events)
+    if history_size > settings.max_request_size:
+        await websocket.close(
+            code=MESSAGE_TOO_BIG, reason="Session history is too large"
+        )
+        return
+    in_flight = asyncio.Semaphore(MAX_PIPELINE_DEPTH)
+    send_lock = asyncio.Lock()
+    tasks = set()
+
+    async def check(id, past: List[Dict], pending: List[Dict]):
+        try:
+            result = await check_events(
+                ipc, session.policy, past, pending, session.mode, INTERACTIVE
+            )
+            message = {"id": id, "result": result}
+        except Exception as e:
+            message = {"id": id, "error": str(e)}
+        finally:
+            in_flight.release()
+        async with send_lock:
+            await websocket.send_json(message)
+
+    try:
+        while True:
+            try:
+                data = await websocket.receive_json()
+            except INVALID_JSON as e:
+                async with send_lock:
+                    await websocket.send_json(
+                        {"id": None, "error": f"Invalid JSON: {e}"}
+                    )
+                continue
+            try:
+                data = schemas.MonitorSessionCheck.model_validate(data)
+            except ValidationError as e:
+                id = data.get("id") if isinstance(data, dict) else None
+                async with send_lock:
+                    await websocket.send_json({"id": id, "error": str(e)})
+                continue
+
+            pending_size = events_size(data.pending_events)
+            if history_size + pending_size > settings.max_request_size:
+                async with send_lock:
+                    await websocket.close(
+                        code=MESSAGE_TOO_BIG, reason="Session history is too large"
+                    )
+                return
+
+            await in_flight.acquire()
+            # the history is snapshotted now, so later events can be checked
+            # before the verdict for this one has been sent
+            task = asyncio.create_task(
+                check(data.id, list(past_events), data.pending_events)
+            )
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            if data.commit:
+                past_events.extend(data.pending_events)
+                history_size += pending_size
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -1,6 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, Header
 from server import schemas
 from server.ipc.controller import get_ipc_controller, IpcController
+from server.ipc.lanes import BULK, parse_lane
+from server.ipc.relevance import filter_events, policy_relevance
 from server.logging import log_request
 from datetime import datetime, timezone
 import json
@@ -12,32 +14,95 @@ from typing import List, Dict
 router = APIRouter()
 
 
-@cached(LRUCache(128), key=lambda body_hash, ipc, policy, trace: hashkey(body_hash))
-async def cached_analyze(
-    body_hash: str, ipc: IpcController, policy: str, trace: List[Dict]
+async def analyze_trace(
+    ipc: IpcController, policy: str, trace: List[Dict], mode: str, lane: str
+):
+    relevance = await policy_relevance(ipc, policy, lane)
+    trace, indices = filter_events(trace, relevance)
+    return await ipc.request(
+        {
+            "type": "analyze",
+            "policy": policy,
+            "trace": trace,
+            "mode": mode,
+            "indices": indices,
+        },
+        lane,
+    )
+
+
+async def analyze_traces(
+    ipc: IpcController, policy: str, traces: List[List[Dict]], mode: str, lane: str
 ):
-    result = await ipc.request({"type": "analyze", "policy": policy, "trace": trace})
+    relevance = await policy_relevance(ipc, policy, lane)
+    filtered = [filter_events(trace, relevance) for trace in traces]
+    result = await ipc.request(
+        {
+            "type": "analyze_batch",
+            "policy": policy,
+            "traces": [trace for trace, _ in filtered],
+            "mode": mode,
+            "indices": [indices for _, indices in filtered],
+        },
+        lane,
+    )
+    # the sandbox answers with a string when any trace of the batch fails
+    if isinstance(result, str):
+        raise RuntimeError(result)
     return result
 
 
+@cached(
+    LRUCache(128),
+    key=lambda body_hash, ipc, policy, trace, mode, lane: hashkey(body_hash),
+)
+async def cached_analyze(
+    body_hash: str,
+    ipc: IpcController,
+    policy: str,
+    trace: List[Dict],
+    mode: str,
+    lane: str,
+):
+    return await analyze_trace(ipc, policy, trace, mode, lane)
+
+
+@cached(
+    LRUCache(128),
+    key=lambda body_hash, ipc, policy, traces, mode, lane: hashkey(body_hash),
+)
+async def cached_analyze_batch(
+    body_hash: str,
+    ipc: IpcController,
+    policy: str,
+    traces: List[List[Dict]],
+    mode: str,
+    lane: str,
+):
+    return await analyze_traces(ipc, policy, traces, mode, lane)
+
+
 @router.post("/analyze")
 async def analyze_policy(
     request: Request,
     data: schemas.PolicyAnalyze,
     ipc: IpcController = Depends(get_ipc_controller),
     cache_control: str | None = Header(None),
+    x_invariant_priority: str | None = Header(None),
 ):
+    try:
+        lane = parse_lane(x_invariant_priority, BULK)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     timestart = datetime.now(timezone.utc).timestamp()
     status_code = 200
     result = {}
     try:
         if cache_control == "no-cache":
-            result = await ipc.request(
-                {"type": "analyze", "policy": data.policy, "trace": data.trace}
-            )
+            result = await analyze_trace(ipc, data.policy, data.trace, data.mode, lane)
         else:
             result = await cached_analyze(
-                request.state.body_hash, ipc, data.policy, data.trace
+                request.state.body_hash, ipc, data.policy, data.trace, data.mode, lane
             )
         return result
     except Exception as e:
@@ -59,3 +124,54 @@ async def analyze_policy(
             status_code,
             response,
         )
+
+
+@router.post("/analyze/batch")
+async def analyze_policy_batch(
+    request: Request,
+    data: schemas.PolicyAnalyzeBatch,
+    ipc: IpcController = Depends(get_ipc_controller),
+    cache_control: str | None = Header(None),
+    x_invariant_priority: str | None = Header(None),
+):
+    try:
+        lane = parse_lane(x_invariant_priority, BULK)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    timestart = datetime.now(timezone.utc).timestamp()
+    status_code = 200
+    result = {}
+    try:
+        if cache_control == "no-cache":
+            result = await analyze_traces(
+                ipc, data.policy, data.traces, data.mode, lane
+            )
+        else:
+            result = await cached_analyze_batch(
+                request.state.body_hash,
+                ipc,
+                data.policy,
+                data.traces,
+                data.mode,
+                lane,
+            )
+        return result
+    except Exception as e:
+        status_code = 500
+        result = {"detail": str(e)}
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        timeend = datetime.now(timezone.utc).timestamp()
+        response = json.dumps(result)
+        await log_request(
+            "POST",
+            "/api/policy/analyze/batch",
+            request.headers.get("x-forwarded-for") or request.client.host,
+            request.headers.get("user-agent", "unknown"),
+            timestart,
+            timeend,
+            request.state.body_hash,
+            request.state.body_content,
+            status_code,
+            response,
+        )
@@ -0,0 +1,19 @@
+from fastapi import APIRouter, Query
+from server import logging
+from datetime import datetime, timezone
+
+router = APIRouter()
+
+
+@router.get("/latency")
+async def latency_stats(
+    since: int | None = Query(
+        None, description="Unix timestamp, defaults to one hour ago"
+    ),
+    until: int | None = Query(None, description="Unix timestamp, defaults to now"),
+    path: str | None = None,
+):
+    now = int(datetime.now(timezone.utc).timestamp())
+    until = until if until is not None else now
+    since = since if since is not None else until - 60 * 60
+    return await logging.latency_stats(since, until, path)
@@ -1,13 +1,33 @@
 from pydantic import BaseModel
-from typing import List, Dict
+from typing import List, Dict, Literal, Optional, Union
 
 
 class PolicyAnalyze(BaseModel):
     trace: List[Dict]
     policy: str
+    mode: Literal["all", "first"] = "all"
+
+
+class PolicyAnalyzeBatch(BaseModel):
+    traces: List[List[Dict]]
+    policy: str
+    mode: Literal["all", "first"] = "all"
 
 
 class MonitorCheck(BaseModel):
     past_events: List[Dict]
     pending_events: List[Dict]
     policy: str
+    mode: Literal["all", "first"] = "all"
+
+
+class MonitorSession(BaseModel):
+    policy: str
+    past_events: List[Dict] = []
+    mode: Literal["all", "first"] = "all"
+
+
+class MonitorSessionCheck(BaseModel):
+    id: Optional[Union[int, str]] = None
+    pending_events: List[Dict]
+    commit: bool = True
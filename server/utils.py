@@ -1,4 +1,6 @@
+import math
 import uuid
+from typing import List, Optional
 
 
 def get_uuid4() -> str:
@@ -12,3 +14,11 @@ def is_valid_uuid4(uuid_str: str) -> bool:
         return False
 
     return str(val) == uuid_str
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    # nearest-rank percentile on an already sorted list
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1))
+    return values[index]
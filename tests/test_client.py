@@ -0,0 +1,243 @@
+import asyncio
+import contextlib
+import gzip
+import json
+import threading
+import httpx
+import pytest
+from websockets.sync.server import serve
+from invariant_client import AsyncInvariantClient, InvariantClient, InvariantError
+from invariant_client import client as client_module
+
+event = {"role": "user", "content": "Hello!"}
+
+
+def mock_client(client, handler):
+    # keeps the client's own settings, but answers requests with ``handler``
+    if isinstance(client, AsyncInvariantClient):
+        client._client = httpx.AsyncClient(
+            base_url=client.server, transport=httpx.MockTransport(handler)
+        )
+    else:
+        client._client.close()
+        client._client = httpx.Client(
+            base_url=client.server, transport=httpx.MockTransport(handler)
+        )
+    return client
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(client_module.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def test_retries_with_retry_after(sleeps):
+    responses = [
+        httpx.Response(429, headers={"retry-after": "2"}, json={"detail": "busy"}),
+        httpx.Response(503, json={"detail": "starting"}),
+        httpx.Response(200, json={"errors": [], "handled_errors": []}),
+    ]
+    client = mock_client(
+        InvariantClient("http://testserver", backoff=0.5),
+        lambda request: responses.pop(0),
+    )
+    with client:
+        assert client.analyze("policy", [event]) == {
+            "errors": [],
+            "handled_errors": [],
+        }
+    assert not responses
+    assert sleeps[0] == 2.0
+    # without a Retry-After header, the delay is jittered below the backoff
+    assert 0 <= sleeps[1] <= 1.0
+
+
+def test_retries_transport_errors(sleeps):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            raise httpx.ConnectError("connection refused", request=request)
+        return httpx.Response(200, json=[])
+
+    with mock_client(InvariantClient("http://testserver"), handler) as client:
+        assert client.check("policy", [], [event]) == []
+    assert len(calls) == 2
+    assert len(sleeps) == 1
+
+
+def test_gives_up_after_max_retries(sleeps):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(503, json={"detail": "overloaded"})
+
+    client = mock_client(InvariantClient("http://testserver", max_retries=2), handler)
+    with client, pytest.raises(InvariantError) as e:
+        client.analyze("policy", [event])
+    assert len(calls) == 3
+    assert e.value.status_code == 503
+    assert e.value.detail == "overloaded"
+
+
+def test_client_errors_are_not_retried(sleeps):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(400, json={"detail": "Invalid priority"})
+
+    with mock_client(InvariantClient("http://testserver"), handler) as client:
+        with pytest.raises(InvariantError) as e:
+            client.analyze("policy", [event])
+    assert len(calls) == 1
+    assert e.value.status_code == 400
+    assert not sleeps
+
+
+def test_sandbox_error_strings_raise():
+    client = mock_client(
+        InvariantClient("http://testserver"),
+        lambda request: httpx.Response(200, json="Invalid trace"),
+    )
+    with client, pytest.raises(InvariantError) as e:
+        client.analyze_batch("policy", [[event]])
+    assert e.value.detail == "Invalid trace"
+
+
+def test_compresses_large_bodies():
+    bodies = []
+
+    def handler(request):
+        content = request.content
+        if request.headers.get("content-encoding") == "gzip":
+            content = gzip.decompress(content)
+        bodies.append((request.headers.get("content-encoding"), json.loads(content)))
+        return httpx.Response(200, json={"errors": [], "handled_errors": []})
+
+    client = mock_client(
+        InvariantClient("http://testserver", compress_threshold=1024), handler
+    )
+    with client:
+        client.analyze("policy", [event])
+        client.analyze("policy", [event] * 100)
+    assert [encoding for encoding, _ in bodies] == [None, "gzip"]
+    assert bodies[1][1]["trace"] == [event] * 100
+
+
+def batch_handler(batches):
+    def handler(request):
+        traces = json.loads(request.content)["traces"]
+        batches.append(len(traces))
+        return httpx.Response(200, json=[trace[0]["content"] for trace in traces])
+
+    return handler
+
+
+def test_analyze_batch_splits_traces():
+    batches = []
+    traces = [[{"role": "user", "content": str(i)}] for i in range(5)]
+    client = mock_client(
+        InvariantClient("http://testserver", batch_size=2), batch_handler(batches)
+    )
+    with client:
+        assert client.analyze_batch("policy", traces) == ["0", "1", "2", "3", "4"]
+    assert batches == [2, 2, 1]
+
+
+def test_async_analyze_batch_keeps_order():
+    traces = [[{"role": "user", "content": str(i)}] for i in range(5)]
+
+    async def handler(request):
+        traces = json.loads(request.content)["traces"]
+        # the first batch finishes last
+        if traces[0][0]["content"] == "0":
+            await asyncio.sleep(0.1)
+        return httpx.Response(200, json=[trace[0]["content"] for trace in traces])
+
+    async def run():
+        client = AsyncInvariantClient("http://testserver", batch_size=2)
+        async with mock_client(client, handler):
+            return await client.analyze_batch("policy", traces)
+
+    assert asyncio.run(run()) == ["0", "1", "2", "3", "4"]
+
+
+def monitor_server(pipeline_depth: int = 1):
+    """Answers every check with the number of events in the history, in
+    reverse order once ``pipeline_depth`` checks have arrived."""
+
+    def handler(websocket):
+        session = json.loads(websocket.recv())
+        history = list(session["past_events"])
+        replies = []
+        for data in websocket:
+            message = json.loads(data)
+            if message["pending_events"] == ["fail"]:
+                replies.append({"id": message["id"], "error": "check failed"})
+            else:
+                replies.append({"id": message["id"], "result": [len(history)]})
+            if message["commit"]:
+                history.extend(message["pending_events"])
+            if len(replies) == pipeline_depth:
+                # unrelated messages have to be skipped by the client
+                websocket.send(json.dumps({"id": None, "error": "Invalid JSON"}))
+                for reply in reversed(replies):
+                    websocket.send(json.dumps(reply))
+                replies.clear()
+
+    return handler
+
+
+@contextlib.contextmanager
+def session_server(handler):
+    with serve(handler, "127.0.0.1", 0) as server:
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            yield f"http://127.0.0.1:{server.socket.getsockname()[1]}"
+        finally:
+            server.shutdown()
+            thread.join()
+
+
+def test_monitor_session():
+    with session_server(monitor_server()) as url, InvariantClient(url) as client:
+        with client.Monitor.from_string("policy").session([event]) as session:
+            assert session.check([event]) == [1]
+            assert session.check([event], commit=False) == [2]
+            assert session.check([event]) == [2]
+            with pytest.raises(InvariantError, match="check failed"):
+                session.check(["fail"], commit=False)
+            assert session.past_events == [event] * 3
+
+
+def test_async_monitor_session_pipelines_checks():
+    async def run():
+        async with AsyncInvariantClient(url) as client:
+            async with client.session("policy") as session:
+                return await asyncio.gather(*[session.check([event]) for _ in range(3)])
+
+    with session_server(monitor_server(pipeline_depth=3)) as url:
+        # verdicts arrive in reverse, but are matched to their checks by id
+        assert asyncio.run(run()) == [[0], [1], [2]]
+
+
+def test_async_monitor_session_fails_pending_checks_on_close():
+    def handler(websocket):
+        websocket.recv()
+        websocket.recv()
+        websocket.close()
+
+    async def run():
+        async with AsyncInvariantClient(url) as client:
+            async with client.session("policy") as session:
+                with pytest.raises(InvariantError, match="session closed"):
+                    await session.check([event])
+
+    with session_server(handler) as url:
+        asyncio.run(run())
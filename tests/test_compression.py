@@ -0,0 +1,81 @@
+import functools
+import gzip
+import json
+import pytest
+import tracemalloc
+from fastapi.testclient import TestClient
+from server.compression import RequestTooLarge, _GzipDecoder, _ZstdDecoder
+from server.main import app
+
+policy = """
+raise "must not send assistant messages" if:
+    (msg: Message)
+    msg.role == "assistant"
+"""
+
+
+def test_gzip_request():
+    with TestClient(app) as client:
+        body = json.dumps(
+            {"policy": policy, "trace": [{"role": "user", "content": "Hello!"}]}
+        ).encode()
+        response = client.post(
+            "/api/policy/analyze",
+            content=gzip.compress(body),
+            headers={"content-type": "application/json", "content-encoding": "gzip"},
+        )
+        assert response.status_code == 200
+        assert response.json() == {"errors": [], "handled_errors": []}
+
+
+def test_unsupported_request_encoding():
+    with TestClient(app) as client:
+        response = client.post(
+            "/api/policy/analyze",
+            content=b"{}",
+            headers={"content-type": "application/json", "content-encoding": "br"},
+        )
+        assert response.status_code == 415
+
+
+def test_gzip_response():
+    with TestClient(app) as client:
+        trace = [{"role": "assistant", "content": "Hello!"}] * 50
+        response = client.post(
+            "/api/policy/analyze",
+            json={"policy": policy, "trace": trace},
+            headers={"accept-encoding": "gzip"},
+        )
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert len(response.json()["errors"]) == 50
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "zstd"])
+def test_decompression_bomb(encoding):
+    if encoding == "zstd":
+        zstandard = pytest.importorskip("zstandard")
+        compress = zstandard.ZstdCompressor().compress
+        decoder = _ZstdDecoder(1024 * 1024)
+    else:
+        compress = functools.partial(gzip.compress, compresslevel=1)
+        decoder = _GzipDecoder(1024 * 1024)
+    bomb = compress(b"\0" * (128 * 1024 * 1024))
+
+    # rejected before more than about the limit has been decoded
+    tracemalloc.start()
+    try:
+        with pytest.raises(RequestTooLarge):
+            decoder.decode(bomb, final=True)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < 8 * 1024 * 1024
+
+    with TestClient(app) as client:
+        response = client.post(
+            "/api/policy/analyze",
+            content=bomb,
+            headers={"content-type": "application/json", "content-encoding": encoding},
+        )
+        assert response.status_code == 413
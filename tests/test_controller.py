@@ -0,0 +1,98 @@
+import asyncio
+import subprocess
+import sys
+import time
+import pytest
+from fastapi.testclient import TestClient
+from server.config import settings
+from server.ipc import controller as controller_module
+from server.ipc.controller import get_ipc_controller
+from server.main import app
+
+trace = [{"role": "user", "content": "Hello!"}]
+policy = """
+raise "must not send assistant messages" if:
+    (msg: Message)
+    msg.role == "assistant"
+"""
+
+
+def fake_sandbox(monkeypatch, code: str):
+    # replaces the sandbox command, keeping everything else about startup
+    popen = subprocess.Popen
+    monkeypatch.setattr(
+        controller_module.subprocess,
+        "Popen",
+        lambda args, **kwargs: popen([sys.executable, "-c", code], **kwargs),
+    )
+
+
+def test_sandbox_stops_when_idle_and_restarts(monkeypatch):
+    monkeypatch.setattr(settings, "idle_timeout", 1)
+    ipc = get_ipc_controller()
+
+    with TestClient(app) as client:
+        response = client.post(
+            "/api/policy/analyze",
+            json={"policy": policy, "trace": trace},
+            headers={"cache-control": "no-cache"},
+        )
+        assert response.status_code == 200
+        assert ipc.exists()
+
+        deadline = time.monotonic() + 10
+        while ipc.process is not None and time.monotonic() < deadline:
+            time.sleep(0.1)
+        assert ipc.process is None
+        assert not ipc.exists()
+
+        # the next request starts the sandbox again and waits until it is ready
+        response = client.post(
+            "/api/policy/analyze",
+            json={"policy": policy, "trace": trace},
+            headers={"cache-control": "no-cache"},
+        )
+        assert response.status_code == 200
+        assert response.json() == {"errors": [], "handled_errors": []}
+        assert ipc.exists()
+
+
+def test_sandbox_startup_failure(monkeypatch):
+    ipc = get_ipc_controller()
+    fake_sandbox(monkeypatch, "import sys; sys.exit(3)")
+
+    with pytest.raises(RuntimeError, match="exited during startup with code 3"):
+        asyncio.run(ipc.start_process())
+    ipc.close()
+
+
+def test_sandbox_startup_timeout(monkeypatch):
+    ipc = get_ipc_controller()
+    monkeypatch.setattr(settings, "sandbox_start_timeout", 0.5)
+    fake_sandbox(monkeypatch, "import time; time.sleep(30)")
+
+    timestart = time.monotonic()
+    with pytest.raises(RuntimeError, match="did not start in time"):
+        asyncio.run(ipc.start_process())
+    assert time.monotonic() - timestart < 5
+    # the process that did not start is not left behind
+    assert ipc.process is None
+
+
+def test_recent_detectors_preload_window(monkeypatch):
+    ipc = get_ipc_controller()
+    monkeypatch.setattr(ipc, "detectors_used", {})
+    monkeypatch.setattr(settings, "preload_window", 100)
+    assert ipc.recent_detectors() == ["pii"]
+
+    now = time.monotonic()
+    monkeypatch.setattr(controller_module.time, "monotonic", lambda: now)
+    ipc.record_detectors("from invariant.detectors import semgrep, secrets")
+    monkeypatch.setattr(controller_module.time, "monotonic", lambda: now + 60)
+    ipc.record_detectors(
+        "from invariant.detectors import prompt_injection as pi\nfrom invariant import Message"
+    )
+    assert ipc.recent_detectors() == ["prompt_injection", "secrets", "semgrep"]
+
+    monkeypatch.setattr(controller_module.time, "monotonic", lambda: now + 120)
+    assert ipc.recent_detectors() == ["prompt_injection"]
@@ -0,0 +1,56 @@
+import asyncio
+from server.ipc.lanes import BULK, INTERACTIVE, LaneScheduler
+
+
+def test_interactive_lane_overtakes_bulk_backlog():
+    scheduler = LaneScheduler(4, {INTERACTIVE: 1}, {INTERACTIVE: 4, BULK: 1})
+    order = []
+
+    async def job(lane):
+        async with scheduler.slot(lane):
+            order.append(lane)
+            await asyncio.sleep(0.01)
+
+    async def run():
+        tasks = [asyncio.create_task(job(BULK)) for _ in range(40)]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(job(INTERACTIVE)) for _ in range(10)]
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    # all interactive jobs run before the first half of the bulk backlog is done
+    assert max(i for i, lane in enumerate(order) if lane == INTERACTIVE) < 25
+    assert all(lane.active == 0 for lane in scheduler.lanes.values())
+
+
+def test_cancelled_waiters_release_their_place():
+    scheduler = LaneScheduler(1, {}, {})
+
+    async def run():
+        async with scheduler.slot(BULK):
+            waiter = asyncio.create_task(scheduler.slot(BULK).__aenter__())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+        async with scheduler.slot(BULK):
+            pass
+
+    asyncio.run(asyncio.wait_for(run(), 1))
+    assert not scheduler.lanes[BULK].waiting
+
+
+def test_reservations_are_scaled_to_capacity():
+    # the default reservation for interactive is larger than this capacity
+    scheduler = LaneScheduler(4, {INTERACTIVE: 8, BULK: 0}, {})
+    assert scheduler.lanes[INTERACTIVE].reserved == 3
+    assert scheduler.shared == 1
+
+    async def run():
+        async with scheduler.slot(BULK):
+            return True
+
+    assert asyncio.run(asyncio.wait_for(run(), 1))
+
+    # reservations that fit are kept, even without shared slots
+    scheduler = LaneScheduler(4, {INTERACTIVE: 2, BULK: 2}, {})
+    assert [lane.reserved for lane in scheduler.lanes.values()] == [2, 2]
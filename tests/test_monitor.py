@@ -1,4 +1,7 @@
+import pytest
 from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+from server.config import settings
 from server.main import app
 
 
@@ -42,3 +45,86 @@ raise PolicyViolation("Cannot send assistant message:", msg) if:
             assert response.status_code == 200
             assert response.json() == responses[i]
             past_events.append(event)
+
+
+def test_monitor_session():
+    with TestClient(app) as client:
+        policy = """
+from invariant import Message, PolicyViolation
+
+raise PolicyViolation("Cannot send assistant message:", msg) if:
+    (msg: Message)
+    msg.role == "assistant"
+    """
+        events = [
+            {"role": "user", "content": "Hello, world!"},
+            {"role": "assistant", "content": "Hello, user 1"},
+            {"role": "user", "content": "Hello, world!"},
+        ]
+
+        with client.websocket_connect("/api/monitor/session") as websocket:
+            websocket.send_json({"policy": policy})
+            # pipeline all events before reading any verdict
+            for i, event in enumerate(events):
+                websocket.send_json({"id": i, "pending_events": [event]})
+            results = {}
+            for _ in events:
+                message = websocket.receive_json()
+                results[message["id"]] = message["result"]
+
+        assert results == {
+            0: [],
+            1: [
+                "PolicyViolation(Cannot send assistant message: metadata={'trace_idx': 1} role='assistant' content='Hello, user 1' tool_calls=None)"
+            ],
+            2: [],
+        }
+
+
+def test_monitor_session_invalid_json():
+    with TestClient(app) as client:
+        policy = """
+raise "must not send assistant messages" if:
+    (msg: Message)
+    msg.role == "assistant"
+    """
+        with client.websocket_connect("/api/monitor/session") as websocket:
+            websocket.send_json({"policy": policy})
+            websocket.send_text("{not json")
+            message = websocket.receive_json()
+            assert message["id"] is None
+            assert message["error"].startswith("Invalid JSON")
+
+            # the session survives the bad frame
+            websocket.send_json(
+                {"id": 1, "pending_events": [{"role": "user", "content": "Hi"}]}
+            )
+            assert websocket.receive_json() == {"id": 1, "result": []}
+
+        with client.websocket_connect("/api/monitor/session") as websocket:
+            websocket.send_text("{not json")
+            with pytest.raises(WebSocketDisconnect) as e:
+                websocket.receive_json()
+            assert e.value.code == 1003
+
+
+def test_monitor_session_history_limit(monkeypatch):
+    monkeypatch.setattr(settings, "max_request_size", 200)
+    event = {"role": "user", "content": "x" * 50}
+    with TestClient(app) as client:
+        with client.websocket_connect("/api/monitor/session") as websocket:
+            websocket.send_json({"policy": "", "past_events": [event]})
+            websocket.send_json({"id": 1, "pending_events": [event]})
+            assert websocket.receive_json()["id"] == 1
+
+            # the third event takes the history past the limit
+            websocket.send_json({"id": 2, "pending_events": [event]})
+            with pytest.raises(WebSocketDisconnect) as e:
+                websocket.receive_json()
+            assert e.value.code == 1009
+
+        with client.websocket_connect("/api/monitor/session") as websocket:
+            websocket.send_json({"policy": "", "past_events": [event] * 3})
+            with pytest.raises(WebSocketDisconnect) as e:
+                websocket.receive_json()
+            assert e.value.code == 1009
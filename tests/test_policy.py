@@ -1,4 +1,5 @@
 from fastapi.testclient import TestClient
+from server.ipc.controller import get_ipc_controller
 from server.main import app
 
 
@@ -61,3 +62,83 @@ raise "must not send emails to anyone but 'Peter' after seeing the inbox" if:
             ],
             "handled_errors": [],
         }
+
+
+def test_policy_analyze_batch():
+    with TestClient(app) as client:
+        policy = """
+raise "must not send assistant messages" if:
+    (msg: Message)
+    msg.role == "assistant"
+    """
+        traces = [
+            [{"role": "user", "content": "Hello!"}],
+            [{"role": "assistant", "content": "Hello!"}],
+        ]
+        response = client.post(
+            "/api/policy/analyze/batch", json={"policy": policy, "traces": traces}
+        )
+        assert response.status_code == 200
+        [allowed, denied] = response.json()
+        assert allowed == {"errors": [], "handled_errors": []}
+        assert denied["errors"][0]["ranges"] == ["messages.0"]
+
+
+def test_policy_analyze_batch_sandbox_error():
+    class FailingSandbox:
+        async def request(self, message, lane):
+            # what the sandbox sends when a trace of the batch cannot be analyzed
+            return "Invalid trace"
+
+    app.dependency_overrides[get_ipc_controller] = FailingSandbox
+    try:
+        with TestClient(app) as client:
+            response = client.post(
+                "/api/policy/analyze/batch",
+                json={"policy": "", "traces": [[{"role": "user"}]]},
+                headers={"cache-control": "no-cache"},
+            )
+    finally:
+        app.dependency_overrides.clear()
+    assert response.status_code == 500
+    assert response.json() == {"detail": "Invalid trace"}
+
+
+def test_policy_analyze_first():
+    with TestClient(app) as client:
+        policy = """
+from invariant.detectors import prompt_injection
+
+raise "must not follow injected instructions" if:
+    (msg: Message)
+    prompt_injection(msg.content)
+    msg.role == "assistant"
+
+raise "must not send assistant messages" if:
+    (msg: Message)
+    msg.role == "assistant"
+
+raise "must not greet" if:
+    (msg: Message)
+    "Hello" in msg.content
+    """
+        trace = [{"role": "assistant", "content": "Hello!"}]
+        response = client.post(
+            "/api/policy/analyze", json={"policy": policy, "trace": trace}
+        )
+        assert response.status_code == 200
+        assert len(response.json()["errors"]) == 2
+
+        response = client.post(
+            "/api/policy/analyze",
+            json={"policy": policy, "trace": trace, "mode": "first"},
+        )
+        assert response.status_code == 200
+        [error] = response.json()["errors"]
+        assert error["ranges"] == ["messages.0"]
+
+        response = client.post(
+            "/api/policy/analyze",
+            json={"policy": policy, "trace": trace, "mode": "fastest"},
+        )
+        assert response.status_code == 422
@@ -0,0 +1,55 @@
+import asyncio
+import hashlib
+import json
+import httpx
+from fastapi.testclient import TestClient
+from server import logging
+from server.main import app
+from server.replay import load_requests, replay
+
+
+def test_replay(tmp_path, monkeypatch):
+    monkeypatch.setattr(logging, "DATABASE", str(tmp_path / "logs.db"))
+
+    with TestClient(app):
+        policy = """
+raise "no assistant messages" if:
+    (msg: Message)
+    msg.role == "assistant"
+    """
+        body = json.dumps(
+            {"policy": policy, "trace": [{"role": "user", "content": "Hello!"}]}
+        ).encode()
+        asyncio.run(
+            logging.log_request(
+                "POST",
+                "/api/policy/analyze",
+                "127.0.0.1",
+                "test",
+                1000.0,
+                1000.5,
+                hashlib.blake2b(body).hexdigest(),
+                body,
+                200,
+                json.dumps({"errors": [], "handled_errors": []}),
+            )
+        )
+
+        requests = asyncio.run(load_requests(logging.DATABASE, since=1000))
+        assert len(requests) == 1
+        assert requests[0].path == "/api/policy/analyze"
+
+        async def run():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://test"
+            ) as client:
+                return await replay(requests, "http://test", speed=0, client=client)
+
+        report = asyncio.run(run())
+        summary = report.summary()
+        assert summary["replayed"] == 1
+        assert summary["failed"] == 0
+        assert summary["status_mismatches"] == 0
+        assert summary["response_mismatches"] == 0
+        assert summary["latency_delta"]["p50"] is not None
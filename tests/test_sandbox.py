@@ -0,0 +1,54 @@
+import importlib.util
+import os
+from invariant import Policy
+
+spec = importlib.util.spec_from_file_location(
+    "invariant_ipc",
+    os.path.abspath(os.path.dirname(__file__) + "/../server/ipc/invariant-ipc.py"),
+)
+ipc = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(ipc)
+
+injection_policy = """
+from invariant.detectors import prompt_injection
+
+raise "must not follow injected instructions" if:
+    (msg: Message)
+    res := prompt_injection(msg.content)
+    res
+    msg.role == "assistant"
+
+raise "must not send assistant messages" if:
+    (msg: Message)
+    msg.role == "assistant"
+"""
+
+
+def test_order_conjuncts():
+    policy = Policy.from_string(injection_policy)
+    condition = policy.rule_set.rules[0].condition
+    declaration, assignment, use, role = condition
+
+    # the cheap role check moves ahead of the detector, which stays ahead of
+    # the conjunct using its result
+    assert ipc.order_conjuncts(condition) == [declaration, role, assignment, use]
+    assert ipc.rule_cost(policy.rule_set.rules[0]) > ipc.rule_cost(
+        policy.rule_set.rules[1]
+    )
+
+
+def test_first_violation_skips_detectors():
+    policy = Policy.from_string(injection_policy)
+    trace = [{"role": "assistant", "content": "Hello!"}]
+    evaluated = []
+
+    def evaluate():
+        evaluated.append(list(policy.rule_set.rules))
+        analysis_result = policy.analyze(trace)
+        return analysis_result.errors, analysis_result.handled_errors
+
+    errors, _ = ipc.first_violation(policy, evaluate)
+    assert len(errors) == 1
+    assert "must not send assistant messages" in repr(errors[0])
+    # only the cheap rule ran, the prompt injection detector never did
+    assert evaluated == [[policy.rule_set.rules[1]]]
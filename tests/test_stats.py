@@ -0,0 +1,144 @@
+import aiosqlite
+import asyncio
+import pytest
+import sqlite3
+from fastapi.testclient import TestClient
+from server import logging
+from server.main import app
+
+
+def test_latency_stats(tmp_path, monkeypatch):
+    monkeypatch.setattr(logging, "DATABASE", str(tmp_path / "logs.db"))
+    monkeypatch.setenv("PROMETHEUS_TOKEN", "token")
+
+    with TestClient(app) as client:
+        for i, status_code in enumerate([200, 200, 200, 500]):
+            asyncio.run(
+                logging.log_request(
+                    "POST",
+                    "/api/policy/analyze",
+                    "127.0.0.1",
+                    "test",
+                    1000.0 + i,
+                    1000.0 + i + (i + 1) / 10,
+                    "hash",
+                    b"{}",
+                    status_code,
+                    "{}",
+                )
+            )
+        asyncio.run(logging.rollup(now=1200))
+
+        response = client.get("/api/stats/latency?since=0&until=2000")
+        assert response.status_code == 401
+
+        response = client.get(
+            "/api/stats/latency?since=0&until=2000",
+            headers={"authorization": "Bearer token"},
+        )
+        assert response.status_code == 200
+        [rollup] = response.json()
+        assert rollup["minute"] == 960
+        assert rollup["path"] == "/api/policy/analyze"
+        assert rollup["count"] == 4
+        assert rollup["errors"] == 1
+        assert rollup["p50"] == pytest.approx(0.2)
+        assert rollup["p99"] == pytest.approx(0.4)
+
+
+def test_prune_deletes_orphaned_bodies_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(logging, "DATABASE", str(tmp_path / "logs.db"))
+    monkeypatch.setattr(logging, "PRUNE_BATCH_SIZE", 2)
+
+    async def run():
+        await logging.init()
+        for i in range(5):
+            await logging.log_request(
+                "POST",
+                "/api/policy/analyze",
+                "127.0.0.1",
+                "test",
+                1000.0 + i,
+                1000.1 + i,
+                f"hash{i}",
+                b"{}",
+                200,
+                "{}",
+            )
+        await logging.log_request(
+            "POST",
+            "/api/policy/analyze",
+            "127.0.0.1",
+            "test",
+            5000.0,
+            5000.1,
+            "recent",
+            b"{}",
+            200,
+            "{}",
+        )
+        monkeypatch.setattr(logging.settings, "log_retention", 1000)
+        await logging.prune(now=5500)
+
+        async with aiosqlite.connect(logging.DATABASE) as db:
+            async with db.execute("SELECT hash FROM request_bodies") as cursor:
+                return [row[0] async for row in cursor]
+
+    assert asyncio.run(run()) == ["recent"]
+
+
+def test_rollup_backfills_retained_rows_in_windows(tmp_path, monkeypatch):
+    monkeypatch.setattr(logging, "DATABASE", str(tmp_path / "logs.db"))
+    monkeypatch.setattr(logging.settings, "log_retention", 3 * 60 * 60)
+    windows = []
+    rollup_window = logging.rollup_window
+
+    async def record_window(db, start, end):
+        windows.append((start, end))
+        await rollup_window(db, start, end)
+
+    monkeypatch.setattr(logging, "rollup_window", record_window)
+
+    async def run():
+        await logging.init()
+        for timestamp in [1000.0, 100000.0]:
+            await logging.log_request(
+                "POST",
+                "/api/policy/analyze",
+                "127.0.0.1",
+                "test",
+                timestamp,
+                timestamp + 0.1,
+                "hash",
+                b"{}",
+                200,
+                "{}",
+            )
+        await logging.rollup(now=100800)
+        return await logging.latency_stats(0, 200000)
+
+    rollups = asyncio.run(run())
+    # rows older than the retention are not read
+    assert windows[0][0] == 100800 - 3 * 60 * 60
+    assert all(end - start <= logging.ROLLUP_WINDOW for start, end in windows)
+    assert windows[-1][1] == 100800
+    assert [rollup["minute"] for rollup in rollups] == [99960]
+
+
+def test_vacuum_migration(tmp_path, monkeypatch):
+    database = str(tmp_path / "logs.db")
+    monkeypatch.setattr(logging, "DATABASE", database)
+    with sqlite3.connect(database) as db:
+        db.execute("CREATE TABLE existing (id INTEGER)")
+
+    async def auto_vacuum():
+        async with aiosqlite.connect(database) as db:
+            async with db.execute("PRAGMA auto_vacuum") as cursor:
+                return (await cursor.fetchone())[0]
+
+    # existing databases are not rebuilt at startup
+    asyncio.run(logging.init())
+    assert asyncio.run(auto_vacuum()) == 0
+
+    logging.main(["vacuum", "--db", database])
+    assert asyncio.run(auto_vacuum()) == 2
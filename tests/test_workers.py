@@ -0,0 +1,107 @@
+import asyncio
+import os
+import pytest
+import socket
+import struct
+import subprocess
+import sys
+import time
+from server.ipc.workers import WorkerPool, WorkerUnauthorized
+
+WORKER = os.path.abspath(os.path.dirname(__file__) + "/../server/ipc/invariant-ipc.py")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_worker(port, token):
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            WORKER,
+            "--preload",
+            "",
+            "--listen",
+            f"tcp://127.0.0.1:{port}",
+        ],
+        env={**os.environ, "INVARIANT_WORKER_TOKEN": token},
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("worker did not start")
+
+
+def test_worker_pool_routes_around_failed_workers():
+    ports = [free_port(), free_port()]
+    workers = [start_worker(port, "secret") for port in ports]
+    try:
+        pool = WorkerPool([f"tcp://127.0.0.1:{port}" for port in ports], "secret")
+        message = {
+            "type": "analyze",
+            "policy": 'raise "no assistant messages" if:\n    (msg: Message)\n    msg.role == "assistant"',
+            "trace": [{"role": "user", "content": "Hello!"}],
+        }
+
+        async def run():
+            await pool.check_health()
+            assert all(endpoint.healthy for endpoint in pool.endpoints)
+            results = [await pool.request(message) for _ in range(4)]
+
+            workers[0].kill()
+            workers[0].wait()
+            results += [await pool.request(message) for _ in range(4)]
+            assert not pool.endpoints[0].healthy
+
+            unauthorized = WorkerPool([f"tcp://127.0.0.1:{ports[1]}"], "wrong")
+            await unauthorized.check_health()
+            assert not unauthorized.endpoints[0].healthy
+            with pytest.raises(WorkerUnauthorized):
+                await unauthorized.request(message)
+            return results
+
+        results = asyncio.run(run())
+        assert results == [{"errors": [], "handled_errors": []}] * 8
+    finally:
+        for worker in workers:
+            worker.kill()
+            worker.wait()
+
+
+def test_worker_rejects_oversized_frames():
+    port = free_port()
+    worker = start_worker(port, "secret")
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=10) as s:
+            # a huge length must not make the worker wait for (or allocate) it
+            s.sendall(struct.pack(">Q", 2**40) + b"{}")
+            try:
+                response = s.recv(8)
+            except ConnectionResetError:
+                # closed with unread input
+                response = b""
+            assert response == b""
+        assert worker.poll() is None
+    finally:
+        worker.kill()
+        worker.wait()
+
+
+def test_worker_requires_token_on_public_address():
+    result = subprocess.run(
+        [sys.executable, WORKER, "--preload", "", "--listen", "tcp://0.0.0.0:7000"],
+        env={k: v for k, v in os.environ.items() if k != "INVARIANT_WORKER_TOKEN"},
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert result.returncode == 2
+    assert "INVARIANT_WORKER_TOKEN" in result.stderr